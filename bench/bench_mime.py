@@ -0,0 +1,80 @@
+"""Compara el coste por mensaje: MIMEMultipart + send_message frente a MessageFactory.
+
+Mide CPU y bytes transmitidos por mensaje. El camino anterior codifica en base64
+los cuerpos no ASCII; MessageFactory los envía en quoted-printable o, si el servidor
+anuncia 8BITMIME, en 8bit.
+
+Uso: python bench/bench_mime.py [numero_de_mensajes]
+"""
+import io
+import os
+import sys
+import time
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_message import MessageFactory, template_context
+
+FROM_EMAIL = "Tienda <tienda@ejemplo.com>"
+SUBJECT = "Novedades de temporada"
+BODIES = {
+    "personalizado": (
+        "Hola {nombre},\n\n"
+        "Te escribimos a {email} para contarte las novedades de este mes. "
+        "Tenemos descuentos en toda la gama de portátiles y periféricos.\n\n"
+        "Un saludo,\nEl equipo de atención al cliente"
+    ),
+    "fijo": (
+        "Hola,\n\n"
+        "Te escribimos para contarte las novedades de este mes. "
+        "Tenemos descuentos en toda la gama de portátiles y periféricos.\n\n"
+        "Un saludo,\nEl equipo de atención al cliente"
+    ),
+}
+
+
+def legacy_bytes(recipient, body_template):
+    """Camino anterior: str.format + MIMEMultipart + aplanado de send_message."""
+    context = template_context(recipient)
+    msg = MIMEMultipart()
+    msg["From"] = FROM_EMAIL
+    msg["To"] = recipient["email"]
+    msg["Subject"] = SUBJECT
+    msg.attach(MIMEText(body_template.format(**context), "plain"))
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=msg.policy.clone(linesep="\r\n")).flatten(msg, linesep="\r\n")
+    return buffer.getvalue()
+
+
+def measure(function, recipients):
+    start = time.process_time()
+    size = 0
+    for recipient in recipients:
+        size += len(function(recipient))
+    elapsed = time.process_time() - start
+    return elapsed / len(recipients) * 1e6, size / len(recipients)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    recipients = [
+        {"email": f"cliente{i}@ejemplo.com", "nombre": f"Cliente Número {i}"}
+        for i in range(count)
+    ]
+    print(f"{count} mensajes por caso")
+    print(f"{'cuerpo':<15}{'camino':<24}{'µs CPU/msg':>12}{'bytes/msg':>12}{'vs anterior':>13}")
+    for label, body in BODIES.items():
+        factory = MessageFactory(FROM_EMAIL, SUBJECT, body)
+        legacy_us, legacy_size = measure(lambda r: legacy_bytes(r, body), recipients)
+        print(f"{label:<15}{'MIMEMultipart (base64)':<24}{legacy_us:>12.1f}{legacy_size:>12.0f}")
+        for path, eightbit in (("Factory (QP)", False), ("Factory (8BITMIME)", True)):
+            factory_us, factory_size = measure(lambda r: factory.build(r, eightbit), recipients)
+            print(f"{'':<15}{path:<24}{factory_us:>12.1f}{factory_size:>12.0f}"
+                  f"{(factory_size - legacy_size) / legacy_size:>+12.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Benchmark de throughput del motor de envío contra el servidor SMTP de pruebas.
+
+Arranca ``fake_smtp_server`` en un proceso aparte y, para cada tamaño de campaña,
+lanza el motor en un proceso nuevo (para medir su memoria por separado). Informa de
+mensajes por segundo, latencia de transmisión p50/p99, pico de memoria (RSS),
+handshakes TLS (cuántos se reanudaron y su tiempo medio) y el tiempo medio de cada
+fase según las métricas del motor (``email_metrics``).
+
+Uso: python bench/bench_sender.py [--sizes 1000 10000 100000] [--connections 4]
+                                  [--latency 0.0] [--recycle-after 0] [--implicit-tls]
+                                  [--json resultados.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from email_engine import EmailSenderEngine, SmtpSettings
+from fake_smtp_server import FakeSMTPServer
+
+BODY_TEMPLATE = (
+    "Hola {nombre},\n\n"
+    "Te escribimos a {email} para contarte las novedades de este mes. "
+    "Tenemos descuentos en toda la gama de portátiles y periféricos.\n\n"
+    "Un saludo,\nEl equipo de atención al cliente"
+)
+
+
+class LatencyRecorder:
+    """Recibe los eventos del motor y se queda solo con las latencias de transmisión."""
+
+    def __init__(self):
+        self.latencies = []
+
+    def put(self, event):
+        if event[0] == "sent":
+            self.latencies.append(event[2])
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows no tiene el módulo resource
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def serve(port_pipe, options):
+    server = FakeSMTPServer(**options)
+    port_pipe.send(server.start_in_thread())
+    while True:
+        time.sleep(3600)
+
+
+def run_campaign(size, port, options, results):
+    recipients = [
+        {"email": f"cliente{i}@ejemplo.com", "nombre": f"Cliente {i}"}
+        for i in range(size)
+    ]
+    recorder = LatencyRecorder()
+    engine = EmailSenderEngine(
+        SmtpSettings("127.0.0.1", port, "bench", "bench", "Bench <bench@ejemplo.com>",
+                     implicit_tls=options["implicit_tls"]),
+        "Novedades para {nombre}",
+        BODY_TEMPLATE,
+        connections=options["connections"],
+        events=recorder,
+        rate_limits={},
+        recycle_after=options["recycle_after"],
+        pipelining=options["pipelining"]
+    )
+    started = time.perf_counter()
+    summary = engine.run(recipients)
+    elapsed = time.perf_counter() - started
+    results.put({
+        "recipients": size,
+        "sent": summary["sent"],
+        "failed": summary["failed"],
+        "seconds": round(elapsed, 3),
+        "msgs_per_second": round(summary["sent"] / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(recorder.latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(recorder.latencies, 0.99) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "tls_handshakes": summary["tls_handshakes"],
+        "tls_resumed": summary["tls_resumed"],
+        "tls_ms": round(summary["tls_seconds"] / summary["tls_handshakes"] * 1000, 3)
+                  if summary["tls_handshakes"] else 0.0,
+        "phases": engine.metrics.summary()["phases"],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de envío de envioemail.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="latencia simulada por ida y vuelta, en segundos")
+    parser.add_argument("--no-pipelining", action="store_true",
+                        help="no usar PIPELINING aunque el servidor lo anuncie")
+    parser.add_argument("--recycle-after", type=int, default=0,
+                        help="reciclar cada sesión tras N mensajes (0 = nunca)")
+    parser.add_argument("--implicit-tls", action="store_true",
+                        help="TLS implícito (como el puerto 465) en lugar de STARTTLS")
+    parser.add_argument("--json", help="guardar los resultados en este fichero")
+    args = parser.parse_args()
+
+    port_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=serve, args=(child_pipe, {"latency": args.latency,
+                                         "implicit_tls": args.implicit_tls}), daemon=True
+    )
+    server.start()
+    port = port_pipe.recv()
+
+    options = {
+        "connections": args.connections,
+        "pipelining": not args.no_pipelining,
+        "recycle_after": args.recycle_after,
+        "implicit_tls": args.implicit_tls,
+    }
+    results = []
+    print(f"Servidor de pruebas en 127.0.0.1:{port}, {args.connections} conexiones, "
+          f"latencia {args.latency * 1000:.0f} ms, "
+          f"PIPELINING {'no' if args.no_pipelining else 'sí'}, "
+          f"{'TLS implícito' if args.implicit_tls else 'STARTTLS'}")
+    print(f"{'destinatarios':>13}{'enviados':>10}{'s':>9}{'msg/s':>10}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}{'TLS':>6}{'reanud.':>9}{'TLS ms':>9}")
+    try:
+        for size in args.sizes:
+            queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=run_campaign,
+                args=(size, port, options, queue)
+            )
+            worker.start()
+            result = queue.get()
+            worker.join()
+            results.append(result)
+            rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] else "-"
+            print(f"{result['recipients']:>13}{result['sent']:>10}{result['seconds']:>9.2f}"
+                  f"{result['msgs_per_second']:>10.0f}{result['p50_ms']:>9.2f}"
+                  f"{result['p99_ms']:>9.2f}{rss:>9}{result['tls_handshakes']:>6}"
+                  f"{result['tls_resumed']:>9}{result['tls_ms']:>9.2f}")
+            phases = " · ".join(f"{phase} {stats['mean_ms']:.3f}"
+                                for phase, stats in result["phases"].items() if stats["count"])
+            print(f"{'':>13}  media por fase (ms): {phases}")
+    finally:
+        server.terminate()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**options, "latency": args.latency, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
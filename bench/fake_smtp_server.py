@@ -0,0 +1,358 @@
+"""Servidor SMTP local de pruebas para medir y probar el motor de envío.
+
+Implementa lo necesario para el motor de envioemail: EHLO, STARTTLS (o TLS
+implícito), AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP y QUIT, anunciando
+PIPELINING, 8BITMIME y SMTPUTF8. Permite simular latencia de red, respuestas de
+error y cortes de conexión. No entrega nada: solo cuenta lo que recibe.
+
+Requiere Python 3.11 o posterior (``StreamWriter.start_tls``). El certificado
+autofirmado de esta carpeta es solo para pruebas.
+
+Uso: python bench/fake_smtp_server.py --port 2525 --latency 0.02
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import ssl
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CERT_FILE = os.path.join(BENCH_DIR, "fake_smtp_cert.pem")
+KEY_FILE = os.path.join(BENCH_DIR, "fake_smtp_key.pem")
+
+
+class ServerStats:
+    """Contadores del servidor (se leen desde otros hilos)."""
+
+    def __init__(self):
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.auth_failures = 0
+        self.transactions = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.disconnects = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class FakeSMTPServer:
+    """Servidor SMTP asíncrono configurable.
+
+    ``latency`` es el retardo (en segundos) de cada ida y vuelta: las respuestas a
+    comandos enviados juntos (PIPELINING) salen en un solo bloque tras una espera.
+    ``rcpt_codes`` asigna un código de respuesta a direcciones concretas; si el valor
+    es una lista, se consume un código por intento (p. ej. ``[451, 451]`` simula
+    greylisting). ``fail_rate`` rechaza al azar destinatarios con ``fail_code``.
+    ``disconnect_after`` corta cada conexión tras N mensajes y ``disconnect_rate``
+    la corta al azar justo después de recibir un mensaje, sin responder.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, rcpt_codes=None,
+                 fail_rate=0.0, fail_code=451, disconnect_after=0, disconnect_rate=0.0,
+                 username=None, password=None, implicit_tls=False, pipelining=True,
+                 eightbitmime=True, smtputf8=True, keep_messages=False):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rcpt_codes = dict(rcpt_codes or {})
+        self.fail_rate = fail_rate
+        self.fail_code = fail_code
+        self.disconnect_after = disconnect_after
+        self.disconnect_rate = disconnect_rate
+        self.username = username
+        self.password = password
+        self.implicit_tls = implicit_tls
+        self.pipelining = pipelining
+        self.eightbitmime = eightbitmime
+        self.smtputf8 = smtputf8
+        self.keep_messages = keep_messages
+        # Lista de (remitente, destinatarios, datos) si keep_messages está activo
+        self.messages = []
+        self.stats = ServerStats()
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(CERT_FILE, KEY_FILE)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._server = None
+
+    def _extensions(self, tls_active):
+        lines = ["fake.localhost", "SIZE 104857600", "AUTH PLAIN LOGIN"]
+        if not tls_active:
+            lines.append("STARTTLS")
+        if self.pipelining:
+            lines.append("PIPELINING")
+        if self.eightbitmime:
+            lines.append("8BITMIME")
+        if self.smtputf8:
+            lines.append("SMTPUTF8")
+        return lines
+
+    def _check_auth(self, user, password):
+        if self.username is None:
+            return True
+        return user == self.username and password == self.password
+
+    def _rcpt_code(self, address):
+        code = self.rcpt_codes.get(address)
+        if isinstance(code, list):
+            with self._lock:
+                code = code.pop(0) if code else None
+        if code is None and self.fail_rate and random.random() < self.fail_rate:
+            code = self.fail_code
+        return code
+
+    async def _handle(self, reader, writer):
+        session = _Session(self, reader, writer)
+        with self._lock:
+            self.stats.connections += 1
+            if self.implicit_tls:
+                self.stats.tls_handshakes += 1
+        try:
+            await session.run()
+        except (ConnectionError, ssl.SSLError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Arranca el servidor en el bucle de eventos actual."""
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port,
+            ssl=self.ssl_context if self.implicit_tls else None
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    def start_in_thread(self):
+        """Arranca el servidor en un hilo propio y devuelve el puerto."""
+        ready = threading.Event()
+
+        def runner():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=runner, name="fake-smtp", daemon=True).start()
+        ready.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class _Session:
+    """Estado de una conexión SMTP."""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.tls_active = server.implicit_tls
+        self.outgoing = []
+        self.sender = None
+        self.recipients = []
+        self.message_count = 0
+
+    def reply(self, line):
+        self.outgoing.append(line.encode("utf-8") + b"\r\n")
+
+    async def flush(self, force=False):
+        """Envía las respuestas acumuladas si el cliente no tiene más comandos en camino."""
+        # Con PIPELINING puede haber varios comandos ya recibidos en el buffer del
+        # StreamReader: se responden juntos, como haría un servidor real
+        if not self.outgoing or (self.reader._buffer and not force):
+            return
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        self.writer.write(b"".join(self.outgoing))
+        self.outgoing = []
+        await self.writer.drain()
+
+    async def readline(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("cliente desconectado")
+        return line
+
+    async def run(self):
+        self.reply("220 fake.localhost ESMTP servidor de pruebas")
+        await self.flush()
+        while True:
+            line = await self.readline()
+            command = line.decode("utf-8", "replace").rstrip("\r\n")
+            verb = command.split(" ", 1)[0].upper()
+            argument = command[len(verb):].strip()
+            handler = getattr(self, "do_" + verb.lower(), None)
+            if handler is None:
+                self.reply("500 5.5.2 Comando no reconocido")
+            elif await handler(argument) is False:
+                await self.flush(force=True)
+                return
+            await self.flush()
+
+    async def do_ehlo(self, argument):
+        lines = self.server._extensions(self.tls_active)
+        for line in lines[:-1]:
+            self.reply("250-" + line)
+        self.reply("250 " + lines[-1])
+
+    async def do_helo(self, argument):
+        self.reply("250 fake.localhost")
+
+    async def do_starttls(self, argument):
+        if self.tls_active:
+            self.reply("503 5.5.1 TLS ya activo")
+            return
+        self.reply("220 2.0.0 Listo para TLS")
+        await self.flush(force=True)
+        await self.writer.start_tls(self.server.ssl_context)
+        self.tls_active = True
+        with self.server._lock:
+            self.server.stats.tls_handshakes += 1
+
+    async def do_auth(self, argument):
+        parts = argument.split()
+        mechanism = parts[0].upper() if parts else ""
+        if mechanism == "PLAIN":
+            if len(parts) > 1:
+                token = parts[1]
+            else:
+                self.reply("334 ")
+                await self.flush(force=True)
+                token = (await self.readline()).decode().strip()
+            _, user, password = base64.b64decode(token).decode("utf-8").split("\0")
+        elif mechanism == "LOGIN":
+            self.reply("334 " + base64.b64encode(b"Username:").decode())
+            await self.flush(force=True)
+            user = base64.b64decode(await self.readline()).decode("utf-8")
+            self.reply("334 " + base64.b64encode(b"Password:").decode())
+            await self.flush(force=True)
+            password = base64.b64decode(await self.readline()).decode("utf-8")
+        else:
+            self.reply("504 5.5.4 Mecanismo no soportado")
+            return
+        if self.server._check_auth(user, password):
+            self.reply("235 2.7.0 Autenticado")
+        else:
+            with self.server._lock:
+                self.server.stats.auth_failures += 1
+            self.reply("535 5.7.8 Credenciales incorrectas")
+
+    async def do_mail(self, argument):
+        self.sender = argument
+        self.recipients = []
+        self.reply("250 2.1.0 Ok")
+
+    async def do_rcpt(self, argument):
+        if self.sender is None:
+            self.reply("503 5.5.1 Falta MAIL FROM")
+            return
+        start, end = argument.find("<"), argument.find(">")
+        address = argument[start + 1:end] if start != -1 and end != -1 else argument
+        code = self.server._rcpt_code(address)
+        if code:
+            with self.server._lock:
+                self.server.stats.rejected += 1
+            self.reply(f"{code} Destinatario rechazado por el servidor de pruebas")
+        else:
+            self.recipients.append(address)
+            self.reply("250 2.1.5 Ok")
+
+    async def do_data(self, argument):
+        if not self.recipients:
+            self.reply("554 5.5.1 No hay destinatarios válidos")
+            return
+        self.reply("354 Termina con <CRLF>.<CRLF>")
+        await self.flush(force=True)
+        chunks = []
+        size = 0
+        while True:
+            line = await self.readline()
+            if line == b".\r\n":
+                break
+            size += len(line)
+            if self.server.keep_messages:
+                chunks.append(line[1:] if line.startswith(b"..") else line)
+
+        server = self.server
+        with server._lock:
+            server.stats.transactions += 1
+            server.stats.messages += len(self.recipients)
+            server.stats.recipients += len(self.recipients)
+            server.stats.bytes += size
+            if server.keep_messages:
+                server.messages.append((self.sender, list(self.recipients), b"".join(chunks)))
+        self.message_count += 1
+        self.sender = None
+        self.recipients = []
+
+        if server.disconnect_rate and random.random() < server.disconnect_rate:
+            # Corte sin responder: el cliente no sabe si el mensaje llegó
+            with server._lock:
+                server.stats.disconnects += 1
+            return False
+        self.reply("250 2.0.0 Ok: encolado")
+        if server.disconnect_after and self.message_count >= server.disconnect_after:
+            with server._lock:
+                server.stats.disconnects += 1
+            self.reply("421 4.7.0 Demasiados mensajes en esta conexión")
+            return False
+
+    async def do_rset(self, argument):
+        self.sender = None
+        self.recipients = []
+        self.reply("250 2.0.0 Ok")
+
+    async def do_noop(self, argument):
+        self.reply("250 2.0.0 Ok")
+
+    async def do_quit(self, argument):
+        self.reply("221 2.0.0 Adiós")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor SMTP local de pruebas.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por ida y vuelta")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="fracción de destinatarios rechazados")
+    parser.add_argument("--fail-code", type=int, default=451)
+    parser.add_argument("--disconnect-after", type=int, default=0,
+                        help="cortar cada conexión tras N mensajes")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0,
+                        help="probabilidad de cortar tras cada mensaje")
+    parser.add_argument("--implicit-tls", action="store_true", help="TLS implícito (como el puerto 465)")
+    parser.add_argument("--no-pipelining", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeSMTPServer(
+        args.host, args.port, latency=args.latency, fail_rate=args.fail_rate,
+        fail_code=args.fail_code, disconnect_after=args.disconnect_after,
+        disconnect_rate=args.disconnect_rate, implicit_tls=args.implicit_tls,
+        pipelining=not args.no_pipelining
+    )
+    port = server.start_in_thread()
+    print(f"Servidor SMTP de pruebas en {args.host}:{port} (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(5)
+            print(server.stats.as_dict())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
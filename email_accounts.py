@@ -0,0 +1,278 @@
+"""Reparto de una campaña entre varias cuentas SMTP, con un proceso por cuenta.
+
+Cada cuenta tiene sus propias credenciales y límites de envío, así que el volumen
+diario total crece con el número de cuentas. Los destinatarios se reparten entre
+las cuentas en proporción a su límite diario, cada proceso ejecuta un
+``EmailSenderEngine`` con su parte y los resultados de todos se juntan en un único
+resumen y un único informe por destinatario.
+"""
+import json
+import multiprocessing
+import os
+import queue
+
+from email_engine import EmailSenderEngine, SmtpSettings
+from email_message import (DEFAULT_VARIABLES, AttachmentPattern, MessageFactory,
+                           missing_attachments)
+from email_ratelimit import limits_for_host
+
+# Claves de un límite de envío en el fichero de cuentas
+LIMIT_KEYS = ("per_second", "per_minute", "per_day")
+
+
+class SenderAccount:
+    """Una cuenta de envío: datos SMTP, límites (None = los del proveedor) y conexiones."""
+
+    def __init__(self, settings, rate_limits=None, connections=None):
+        self.settings = settings
+        self.rate_limits = rate_limits
+        self.connections = connections
+
+    @property
+    def label(self):
+        return self.settings.user
+
+    @property
+    def weight(self):
+        """Peso en el reparto: el límite diario que aplicará el motor, o None si no hay."""
+        # Sin límites propios, el motor usa los predefinidos del proveedor
+        limits = self.rate_limits if self.rate_limits is not None else limits_for_host(
+            self.settings.server)
+        return limits.get("per_day")
+
+    @classmethod
+    def from_dict(cls, data):
+        """Crea la cuenta a partir de una entrada del fichero de cuentas.
+
+        La contraseña puede ir en ``password`` o, mejor, en la variable de entorno
+        que indique ``password_env``. Lanza ``ValueError`` si falta algún dato.
+        """
+        missing = [key for key in ("server", "user") if not data.get(key)]
+        if missing:
+            raise ValueError(f"A la cuenta le falta: {', '.join(missing)}.")
+        password = data.get("password")
+        if not password and data.get("password_env"):
+            password = os.environ.get(data["password_env"], "")
+        if not password:
+            raise ValueError(f"Falta la contraseña de la cuenta {data['user']} "
+                             "(password o password_env).")
+        settings = SmtpSettings(
+            data["server"],
+            int(data.get("port", 587)),
+            data["user"],
+            password,
+            data.get("from") or data["user"],
+            implicit_tls=data.get("implicit_tls"),
+        )
+        limits = {key: data[key] for key in LIMIT_KEYS if data.get(key)}
+        connections = data.get("connections")
+        return cls(settings, limits or None, int(connections) if connections else None)
+
+
+def load_accounts(file_path):
+    """Lee las cuentas de un fichero JSON (una lista de objetos); lanza ``ValueError``."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"El fichero de cuentas no es un JSON válido: {e}")
+    if not isinstance(data, list) or not data:
+        raise ValueError("El fichero de cuentas debe contener una lista de cuentas.")
+    return [SenderAccount.from_dict(item) for item in data]
+
+
+def shard_recipients(recipients, weights):
+    """Reparte los destinatarios entre len(weights) cuentas en proporción a su peso.
+
+    Se asignan de uno en uno a la cuenta que más lejos esté de su parte (round-robin
+    ponderado), así que cada cuenta recibe una mezcla de dominios y no un bloque.
+    """
+    total_weight = sum(weights)
+    shards = [[] for _ in weights]
+    credit = [0.0] * len(weights)
+    for recipient in recipients:
+        for index, weight in enumerate(weights):
+            credit[index] += weight
+        chosen = max(range(len(weights)), key=credit.__getitem__)
+        credit[chosen] -= total_weight
+        shards[chosen].append(recipient)
+    return shards
+
+
+class _AccountEvents:
+    """Reenvía los eventos del motor de una cuenta al proceso principal."""
+
+    def __init__(self, index, events):
+        self.index = index
+        self.events = events
+
+    def put(self, event):
+        # Los "sent" no se reenvían: el progreso ya llega con "progress"
+        if event[0] != "sent":
+            self.events.put((self.index,) + tuple(event))
+
+
+def _run_account(index, account, subject, body_template, recipients, options, events):
+    """Proceso de una cuenta: envía su parte y devuelve el resumen y los resultados."""
+    options = dict(options)
+    connections = account.connections or options.pop("connections", 1)
+    options.pop("connections", None)
+    try:
+        engine = EmailSenderEngine(account.settings, subject, body_template,
+                                   connections=connections, events=_AccountEvents(index, events),
+                                   rate_limits=account.rate_limits, **options)
+        summary = engine.run(recipients)
+    except Exception as e:
+        events.put((index, "fatal", f"Error inesperado: {e}"))
+        return
+    events.put((index, "result", summary, engine.results))
+
+
+class MultiAccountEngine:
+    """Envía una campaña repartida entre varias cuentas, con un proceso por cuenta.
+
+    ``accounts`` es una lista de ``SenderAccount``. Los destinatarios se reparten en
+    proporción al límite diario de cada cuenta, el suyo o el de su proveedor; las
+    que no tienen ninguno reciben como la que más (a partes iguales si ninguna lo
+    tiene). El resto de argumentos con nombre se pasan a cada ``EmailSenderEngine``
+    (``connections`` solo se usa para las cuentas que no indican las suyas).
+
+    Publica en ``events`` los mismos eventos que ``EmailSenderEngine``: los ``log``
+    llevan delante la cuenta y ``progress`` y ``rate`` suman todas las cuentas. Al
+    terminar, ``results`` tiene el resultado de cada destinatario y ``assignments``
+    la cuenta que se encargó de él; el resumen incluye el de cada cuenta en
+    ``accounts``. No admite bandeja de salida: cada proceso trabaja en memoria.
+    """
+
+    def __init__(self, accounts, subject, body_template, events=None, **engine_options):
+        if not accounts:
+            raise ValueError("Hace falta al menos una cuenta de envío.")
+        self.accounts = list(accounts)
+        self.subject = subject
+        self.body_template = body_template
+        # Valida las plantillas antes de arrancar ningún proceso
+        MessageFactory(accounts[0].settings.from_email, subject, body_template,
+                       engine_options.get("variables", DEFAULT_VARIABLES))
+        self.events = events if events is not None else queue.Queue()
+        self.engine_options = engine_options
+        self.results = {}
+        self.assignments = {}
+        self._progress = {}
+        self._rates = {}
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def preflight(self, recipients):
+        """Adjuntos personales que no existen, como ``(destinatario, ruta)``."""
+        options = self.engine_options
+        patterns = [AttachmentPattern(pattern, options.get("variables", DEFAULT_VARIABLES),
+                                      options.get("attachments_dir"))
+                    for pattern in options.get("attachment_patterns", ())]
+        return missing_attachments(patterns, recipients)
+
+    def run(self, recipients):
+        """Reparte y envía la campaña; devuelve el resumen combinado."""
+        weights = [account.weight for account in self.accounts]
+        known = [weight for weight in weights if weight]
+        if known:
+            # Una cuenta sin límite diario recibe tanto como la que más
+            weights = [weight or max(known) for weight in weights]
+        else:
+            weights = [1] * len(self.accounts)
+        shards = shard_recipients(recipients, weights)
+        for account, shard in zip(self.accounts, shards):
+            for recipient in shard:
+                self.assignments[recipient["email"]] = account.label
+        self.emit("log", "Campaña repartida entre {} cuentas: {}".format(
+            len(self.accounts),
+            ", ".join(f"{account.label} ({len(shard)})"
+                      for account, shard in zip(self.accounts, shards))))
+
+        # spawn en todas las plataformas: no se heredan los hilos del proceso principal
+        context = multiprocessing.get_context("spawn")
+        events = context.Queue()
+        processes = {}
+        for index, (account, shard) in enumerate(zip(self.accounts, shards)):
+            if not shard:
+                continue
+            process = context.Process(
+                target=_run_account,
+                args=(index, account, self.subject, self.body_template, shard,
+                      self.engine_options, events),
+                name=f"cuenta-{index + 1}",
+                daemon=True
+            )
+            process.start()
+            processes[index] = process
+            self._progress[index] = (0, 0, len(shard))
+
+        summaries = {}
+        finished = set()
+        while len(finished) < len(processes):
+            try:
+                event = events.get(timeout=0.5)
+            except queue.Empty:
+                # Un proceso que muere sin enviar su resultado deja su parte pendiente
+                for index, process in processes.items():
+                    if index not in finished and not process.is_alive():
+                        finished.add(index)
+                        self.emit("log", f"[{self.accounts[index].label}] El proceso de envío "
+                                         f"terminó inesperadamente (código {process.exitcode}).",
+                                  "error")
+                continue
+            self._handle(event, summaries, finished)
+        for process in processes.values():
+            process.join()
+
+        summary = self._merge(len(recipients), summaries)
+        if recipients and not summary["sent"] and not summary["tls_handshakes"]:
+            self.emit("fatal", "No se pudo enviar con ninguna de las cuentas.")
+        self.emit("done", summary)
+        return summary
+
+    def _handle(self, event, summaries, finished):
+        index, kind = event[0], event[1]
+        label = self.accounts[index].label
+        if kind == "result":
+            summaries[index] = event[2]
+            self.results.update(event[3])
+            finished.add(index)
+        elif kind == "log":
+            self.emit("log", f"[{label}] {event[2]}", *event[3:])
+        elif kind == "adaptive":
+            # Cada cuenta tiene su propio controlador: se indica de cuál es el estado
+            self.emit("adaptive", {"account": label, **event[2]}, event[3])
+        elif kind == "fatal":
+            # Las demás cuentas siguen enviando: se informa como error de esta cuenta
+            self.emit("log", f"[{label}] {event[2]}", "error")
+        elif kind == "progress":
+            self._progress[index] = event[2:5]
+            self.emit("progress", *(sum(values) for values in zip(*self._progress.values())))
+        elif kind == "rate":
+            self._rates[index] = event[2:4]
+            per_second = sum(rate for rate, _ in self._rates.values())
+            if per_second:
+                error_rate = sum(rate * errors for rate, errors in self._rates.values()) / per_second
+            else:
+                error_rate = max(errors for _, errors in self._rates.values())
+            self.emit("rate", per_second, error_rate)
+
+    def _merge(self, total, summaries):
+        accounts = []
+        for index, account in enumerate(self.accounts):
+            item = summaries.get(index)
+            accounts.append({"account": account.label, **(item or {})})
+        merged = {
+            "total": total,
+            "sent": sum(item["sent"] for item in summaries.values()),
+            "failed": sum(item["failed"] for item in summaries.values()),
+            "uncertain": sum(item["uncertain"] for item in summaries.values()),
+            "retried": sum(item["retried"] for item in summaries.values()),
+            "tls_handshakes": sum(item["tls_handshakes"] for item in summaries.values()),
+            "tls_resumed": sum(item["tls_resumed"] for item in summaries.values()),
+            "tls_seconds": round(sum(item["tls_seconds"] for item in summaries.values()), 3),
+            "accounts": accounts,
+        }
+        merged["pending"] = total - merged["sent"] - merged["failed"] - merged["uncertain"]
+        return merged
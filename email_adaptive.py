@@ -0,0 +1,199 @@
+"""Control adaptativo (AIMD) del número de conexiones y del ritmo de envío.
+
+Como el control de congestión de TCP: mientras el servidor responde 2xx se suben
+las conexiones y el ritmo (al principio duplicándolos, después de poco en poco) y
+ante una respuesta de saturación (421, 451, 452) o una latencia que se dispara se
+reducen a la mitad. Así el motor encuentra solo el ritmo más alto que acepta cada
+servidor, sin tener que adivinar el número de conexiones.
+"""
+import threading
+import time
+
+from email_ratelimit import TokenBucket
+
+# Respuestas SMTP que indican que el servidor está saturado o limitando
+CONGESTION_CODES = (421, 451, 452)
+
+
+class AdaptiveController:
+    """Controlador AIMD compartido por todas las conexiones de una campaña.
+
+    ``connections`` (de 1 a ``max_connections``) es el número de conexiones que
+    pueden estar enviando a la vez: cada una ocupa un turno con ``acquire_slot`` y lo
+    cede con ``should_yield`` cuando el límite baja. ``rate`` son los mensajes por
+    segundo permitidos (``wait_rate`` espera a tenerlos).
+
+    Cada ``interval`` segundos sin saturación se suben ambos: se duplican hasta la
+    primera saturación y después suben de ``connection_step`` en ``connection_step`` y
+    de un octavo del ritmo que había tras la última bajada (al menos ``rate_step``).
+    El ritmo solo sube si se está aprovechando. Una respuesta de
+    ``CONGESTION_CODES``, o una latencia media de la ventana mayor que
+    ``latency_factor`` veces la mejor vista, los reduce a la mitad (como mucho una
+    vez por ventana). ``on_change(estado, motivo)`` se llama tras cada cambio.
+    """
+
+    def __init__(self, max_connections, start_connections=1, start_rate=1.0, min_rate=0.2,
+                 max_rate=None, rate_step=1.0, connection_step=1, interval=2.0,
+                 latency_factor=2.0, on_change=None):
+        self.max_connections = max(1, int(max_connections))
+        self.connections = min(self.max_connections, max(1, int(start_connections)))
+        self.rate = float(start_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_step = rate_step
+        self.connection_step = connection_step
+        self.interval = interval
+        self.latency_factor = latency_factor
+        self.on_change = on_change
+        # Se duplica mientras no haya habido ninguna saturación (arranque lento de TCP)
+        self.slow_start = True
+        self._rate_increment = rate_step
+        self.increases = 0
+        self.decreases = 0
+        self._bucket = TokenBucket(self.rate, max(1.0, self.rate))
+        self._active = 0
+        self._closed = False
+        self._best_latency = None
+        self._last_decrease = None
+        self._cond = threading.Condition()
+        self._reset_window(time.monotonic())
+
+    # --- Turnos de conexión ---
+
+    def acquire_slot(self):
+        """Espera un turno de conexión; devuelve False si la campaña ha terminado."""
+        with self._cond:
+            while not self._closed and self._active >= self.connections:
+                self._cond.wait()
+            if self._closed:
+                return False
+            self._active += 1
+            return True
+
+    def release_slot(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def should_yield(self):
+        """Cede el turno (y devuelve True) si hay más conexiones activas que el límite."""
+        with self._cond:
+            if self._active > self.connections:
+                self._active -= 1
+                self._cond.notify_all()
+                return True
+            return False
+
+    def close(self):
+        """Fin de la campaña: despierta a las conexiones que esperan turno."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    # --- Ritmo ---
+
+    def wait_rate(self, count=1):
+        """Espera a que el ritmo actual permita enviar ``count`` mensajes."""
+        while True:
+            with self._cond:
+                wait = self._bucket.wait_time(time.monotonic(), count)
+                if wait <= 0:
+                    self._bucket.consume(count)
+                    return
+            time.sleep(min(wait, 0.5))
+
+    # --- Señales ---
+
+    def on_success(self, latency, count=1):
+        """Transacción aceptada (2xx) en ``latency`` segundos para ``count`` destinatarios."""
+        change = None
+        with self._cond:
+            self._sent += count
+            self._latency_total += latency
+            self._latency_count += 1
+            now = time.monotonic()
+            if now - self._window_started >= self.interval:
+                change = self._evaluate(now)
+        self._notify(change)
+
+    def on_reply(self, code):
+        """Respuesta de error del servidor; las de saturación reducen el ritmo."""
+        if code not in CONGESTION_CODES:
+            return
+        with self._cond:
+            change = self._decrease(time.monotonic(), f"respuesta {code}")
+        self._notify(change)
+
+    def state(self):
+        with self._cond:
+            return {
+                "connections": self.connections,
+                "active": self._active,
+                "max_connections": self.max_connections,
+                "rate": round(self.rate, 2),
+                "slow_start": self.slow_start,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+    # --- Internos (con el lock tomado) ---
+
+    def _reset_window(self, now):
+        self._window_started = now
+        self._sent = 0
+        self._latency_total = 0.0
+        self._latency_count = 0
+
+    def _evaluate(self, now):
+        elapsed = now - self._window_started
+        latency = self._latency_total / self._latency_count
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        if latency > self._best_latency * self.latency_factor:
+            return self._decrease(now, f"latencia {latency * 1000:.0f} ms")
+        throughput = self._sent / elapsed
+        before = (self.connections, self.rate)
+        if self.slow_start:
+            connections = self.connections * 2
+            rate = self.rate * 2
+        else:
+            connections = self.connections + self.connection_step
+            rate = self.rate + self._rate_increment
+        self.connections = min(self.max_connections, connections)
+        # Subir el ritmo solo tiene sentido si el actual se está aprovechando
+        if throughput >= self.rate * 0.7:
+            self._set_rate(rate if self.max_rate is None else min(self.max_rate, rate), now)
+        self._reset_window(now)
+        if (self.connections, self.rate) == before:
+            return None
+        self.increases += 1
+        self._cond.notify_all()
+        return "sin saturación"
+
+    def _decrease(self, now, reason):
+        # Una sola bajada por ventana: las respuestas de una misma ráfaga cuentan una vez
+        if self._last_decrease is not None and now - self._last_decrease < self.interval:
+            return None
+        self._last_decrease = now
+        self._set_rate(max(self.min_rate, self.rate / 2), now)
+        # Subida aditiva: recuperar el ritmo anterior a la bajada lleva unas 8 ventanas
+        self._rate_increment = max(self.rate_step, self.rate / 8)
+        self.connections = max(1, self.connections // 2)
+        self.slow_start = False
+        self.decreases += 1
+        # La latencia de referencia se vuelve a medir con la carga nueva
+        self._best_latency = None
+        self._reset_window(now)
+        return reason
+
+    def _set_rate(self, rate, now):
+        # Repone las fichas acumuladas al ritmo anterior antes de cambiarlo
+        self._bucket.wait_time(now)
+        self.rate = rate
+        self._bucket.rate = rate
+        self._bucket.capacity = max(1.0, rate)
+        self._bucket.tokens = min(self._bucket.tokens, self._bucket.capacity)
+
+    def _notify(self, change):
+        if change is not None and self.on_change is not None:
+            self.on_change(self.state(), change)
@@ -0,0 +1,171 @@
+"""Simulación de campañas: genera todos los mensajes y los guarda en un buzón local.
+
+Usa el mismo ``MessageFactory`` que el envío real, pero en lugar de SMTP escribe
+cada mensaje en un fichero mbox o en un directorio Maildir para revisarlo con un
+cliente de correo. El render y la serialización se reparten entre procesos para
+aprovechar todos los núcleos.
+"""
+import mailbox
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from email_message import (DEFAULT_VARIABLES, Attachment, AttachmentError, AttachmentPattern,
+                           FileAttachment, MessageFactory, message_bytes, missing_attachments)
+
+MAILBOX_FORMATS = ("mbox", "maildir")
+
+# Fábrica de cada proceso de trabajo (se crea una vez en el inicializador)
+_worker_factory = None
+_worker_eightbit = True
+_worker_patterns = []
+
+
+def _init_worker(from_email, subject, body_template, eightbit, attachments=(),
+                 variables=DEFAULT_VARIABLES, attachment_patterns=(), attachments_dir=None):
+    global _worker_factory, _worker_eightbit, _worker_patterns
+    _worker_factory = MessageFactory(from_email, subject, body_template, variables,
+                                     attachments=attachments)
+    _worker_eightbit = eightbit
+    _worker_patterns = [AttachmentPattern(pattern, variables, attachments_dir)
+                        for pattern in attachment_patterns]
+
+
+def _build_chunk(recipients):
+    """Mensajes de un bloque de destinatarios, con saltos de línea locales para el buzón."""
+    messages = []
+    for recipient in recipients:
+        personal = [FileAttachment(pattern.resolve(recipient)) for pattern in _worker_patterns]
+        message = _worker_factory.build(recipient, _worker_eightbit, personal)
+        messages.append(message_bytes(message).replace(b"\r\n", b"\n"))
+    return messages
+
+
+class DryRunEngine:
+    """Ejecuta una campaña sin servidor SMTP y guarda los mensajes en ``path``.
+
+    Publica en ``events`` los mismos eventos que ``EmailSenderEngine`` (``log``,
+    ``progress``, ``rate`` y ``done``), así que la interfaz y la línea de comandos lo
+    tratan igual; ``progress`` y el ``sent`` del resumen cuentan los mensajes ya
+    guardados. Los mensajes se generan en ``processes`` procesos (por defecto uno
+    por núcleo) en bloques de ``chunk_size`` destinatarios; con ``processes=1`` se
+    generan en el propio proceso. ``eightbit`` simula un servidor con 8BITMIME. Los ``attachments`` (rutas)
+    se codifican una sola vez aquí y se pasan ya codificados a cada proceso.
+
+    Los adjuntos personales (``attachment_patterns``, ``attachments_dir`` y
+    ``variables`` como en ``EmailSenderEngine``) se comprueban antes de empezar: los
+    destinatarios cuyo fichero falta se cuentan como fallidos y no se guardan.
+
+    Las plantillas se compilan al crear el objeto: si no son válidas se lanza
+    ``TemplateError``.
+    """
+
+    def __init__(self, from_email, subject, body_template, path, mailbox_format="mbox",
+                 events=None, processes=None, chunk_size=500, eightbit=True, attachments=(),
+                 attachment_patterns=(), attachments_dir=None, variables=DEFAULT_VARIABLES):
+        if mailbox_format not in MAILBOX_FORMATS:
+            raise ValueError(f"Formato de buzón no soportado: {mailbox_format}")
+        self.from_email = from_email
+        self.subject = subject
+        self.body_template = body_template
+        self.attachments = [Attachment.from_path(path) for path in attachments]
+        self.attachment_patterns = list(attachment_patterns)
+        self.attachments_dir = attachments_dir
+        self.variables = tuple(variables)
+        # Valida las plantillas antes de arrancar ningún proceso
+        MessageFactory(from_email, subject, body_template, self.variables)
+        self._patterns = [AttachmentPattern(pattern, self.variables, attachments_dir)
+                          for pattern in self.attachment_patterns]
+        self.path = path
+        self.mailbox_format = mailbox_format
+        self.events = events if events is not None else queue.Queue()
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = max(1, int(chunk_size))
+        self.eightbit = eightbit
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def run(self, recipients):
+        """Genera y guarda todos los mensajes; devuelve el resumen de la simulación."""
+        total = len(recipients)
+        failed = 0
+        if self._patterns:
+            missing = self.preflight(recipients)
+            skipped = set()
+            for recipient, path in missing:
+                if id(recipient) not in skipped:
+                    skipped.add(id(recipient))
+                    self.emit("log", f"No se genera el mensaje de {recipient['email']}: "
+                                     f"falta el adjunto {path}", "error")
+            recipients = [recipient for recipient in recipients if id(recipient) not in skipped]
+            failed = len(skipped)
+        chunks = [recipients[start:start + self.chunk_size]
+                  for start in range(0, len(recipients), self.chunk_size)]
+        self.emit("log", f"Simulación: {total} mensajes a {self.path} ({self.mailbox_format}, "
+                         f"{min(self.processes, len(chunks)) or 1} procesos)")
+        started = time.perf_counter()
+        written = 0
+        try:
+            box = self._open_mailbox()
+            try:
+                for messages in self._build_chunks(chunks):
+                    for message in messages:
+                        box.add(message)
+                    written += len(messages)
+                    elapsed = time.perf_counter() - started
+                    self.emit("progress", written, failed, total)
+                    self.emit("rate", written / elapsed if elapsed else 0.0, 0.0)
+                box.flush()
+            finally:
+                box.unlock()
+                box.close()
+        except OSError as e:
+            self.emit("fatal", f"No se pudo escribir el buzón {self.path}: {e}")
+        except AttachmentError as e:
+            self.emit("fatal", f"Simulación interrumpida: {e}")
+        elapsed = time.perf_counter() - started
+
+        summary = {
+            "total": total,
+            # Como en ``progress``: los mensajes guardados cuentan como enviados
+            "sent": written,
+            "failed": failed,
+            "pending": total - written - failed,
+            "written": written,
+            "path": self.path,
+            "seconds": round(elapsed, 3),
+            "msgs_per_second": round(written / elapsed, 1) if elapsed else 0.0,
+        }
+        if written + failed == total:
+            self.emit("log", f"Simulación completada: {written} mensajes en {elapsed:.1f} s "
+                             f"({summary['msgs_per_second']:.0f} msg/s)", "success")
+        self.emit("done", summary)
+        return summary
+
+    def preflight(self, recipients):
+        """Adjuntos personales que no existen, como ``(destinatario, ruta)``."""
+        return missing_attachments(self._patterns, recipients)
+
+    def _open_mailbox(self):
+        if self.mailbox_format == "maildir":
+            box = mailbox.Maildir(self.path, create=True)
+        else:
+            box = mailbox.mbox(self.path, create=True)
+        box.lock()
+        return box
+
+    def _build_chunks(self, chunks):
+        """Genera los bloques en orden, en paralelo si hay más de un proceso."""
+        init_args = (self.from_email, self.subject, self.body_template, self.eightbit,
+                     self.attachments, self.variables, self.attachment_patterns,
+                     self.attachments_dir)
+        if self.processes == 1 or len(chunks) <= 1:
+            _init_worker(*init_args)
+            for chunk in chunks:
+                yield _build_chunk(chunk)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(chunks)),
+                                 initializer=_init_worker, initargs=init_args) as executor:
+            yield from executor.map(_build_chunk, chunks)
@@ -0,0 +1,1412 @@
+"""Motor de envío SMTP de envioemail (no depende de tkinter)."""
+import csv
+import heapq
+import itertools
+import os
+import queue
+import random
+import re
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.utils import parseaddr
+from email_adaptive import AdaptiveController
+from email_message import (DEFAULT_VARIABLES, Attachment, AttachmentError, AttachmentPattern,
+                           DotSafeBytes, FileAttachment, MessageFactory, missing_attachments)
+from email_metrics import SendMetrics
+from email_outbox import (STATUS_FAILED, STATUS_PENDING, STATUS_SENT, STATUS_UNKNOWN,
+                          message_hash)
+from email_ratelimit import RateLimiter, TokenBucket, describe_limits, limits_for_host
+
+
+def load_recipients_csv(file_path):
+    """Lee los destinatarios de un CSV con columnas 'nombre' y 'email' (separado por comas).
+
+    Devuelve una lista de diccionarios ``{"nombre": ..., "email": ...}`` con las filas
+    válidas; lanza ``ValueError`` si faltan las columnas. Las demás columnas se
+    conservan con el nombre en minúsculas y ``_`` en lugar de espacios y guiones
+    (``Client Code`` pasa a ``client_code``), para usarlas como variables.
+    """
+    recipients = []
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f, delimiter=',')
+        # Normalizar las columnas a minúsculas
+        fieldnames_lower = [col.strip().lower() for col in (reader.fieldnames or [])]
+        if 'nombre' not in fieldnames_lower or 'email' not in fieldnames_lower:
+            raise ValueError("El CSV debe contener columnas 'nombre' y 'email'.")
+        for row in reader:
+            # Las celdas sobrantes (clave None) y las columnas sin nombre se descartan
+            row = {column_variable(key): (value or "").strip()
+                   for key, value in row.items() if key and key.strip()}
+            nombre = row.pop('nombre', '')
+            email = row.pop('email', '')
+            if '@' in email:
+                recipients.append({"nombre": nombre or email, "email": email, **row})
+    return recipients
+
+
+def write_report(file_path, recipients, results, accounts=None):
+    """Escribe un CSV con el resultado de cada destinatario.
+
+    ``results`` relaciona cada email con ``(estado, detalle)``; los que no aparecen
+    quedan como pendientes. ``accounts`` (email → cuenta) añade la columna ``cuenta``.
+    """
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        header = ["email", "nombre", "estado", "detalle"]
+        if accounts is not None:
+            header.append("cuenta")
+        writer.writerow(header)
+        for recipient in recipients:
+            email = recipient["email"]
+            status, detail = results.get(email, (STATUS_PENDING, ""))
+            row = [email, recipient.get("nombre", ""), status, detail]
+            if accounts is not None:
+                row.append(accounts.get(email, ""))
+            writer.writerow(row)
+
+
+def column_variable(column):
+    """Nombre de variable de una columna del CSV: ``"Client Code"`` → ``"client_code"``."""
+    return re.sub(r"[\s\-]+", "_", column.strip().lower())
+
+
+def is_connection_error(error):
+    """Indica si el error significa que la sesión SMTP se ha perdido y hay que reconectar."""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 421: el servidor cierra el canal de transmisión
+        return error.smtp_code == 421
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(code == 421 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    # Errores de socket, TLS y timeouts
+    return isinstance(error, OSError)
+
+
+def classify_error(error):
+    """Clasifica un error de envío según el código de respuesta SMTP.
+
+    Devuelve ``"connection"`` si hay que reconectar, ``"transient"`` para respuestas
+    4xx (greylisting, buzón ocupado, límites temporales) y ``"permanent"`` para 5xx
+    o cualquier otro error.
+    """
+    if is_connection_error(error):
+        return "connection"
+    code = None
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        code = min(codes) if codes else None
+    elif isinstance(error, smtplib.SMTPResponseException):
+        code = error.smtp_code
+    if code is not None and 400 <= code < 500:
+        return "transient"
+    return "permanent"
+
+
+def reply_codes(error):
+    """Códigos de respuesta SMTP contenidos en un error (vacío si no viene del servidor)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return [code for code, _ in error.recipients.values()]
+    if isinstance(error, smtplib.SMTPResponseException):
+        return [error.smtp_code]
+    return []
+
+
+def describe_error(error):
+    """Texto breve de un error SMTP para el log (``"451 4.7.1 Try again later"``)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        code, message = next(iter(error.recipients.values()))
+    elif isinstance(error, smtplib.SMTPResponseException):
+        code, message = error.smtp_code, error.smtp_error
+    else:
+        return str(error)
+    if isinstance(message, bytes):
+        message = message.decode("utf-8", "replace")
+    return f"{code} {message}"
+
+
+# Puerto estándar de SMTP con TLS implícito (RFC 8314)
+IMPLICIT_TLS_PORT = 465
+
+# Tamaño a partir del cual los fragmentos del mensaje se envían sin agruparlos
+DATA_CHUNK_SIZE = 65536
+
+
+class SmtpSettings:
+    """Datos de conexión a un servidor SMTP.
+
+    ``implicit_tls`` indica si la conexión empieza ya cifrada (SMTPS) en lugar de
+    usar STARTTLS; si es None se deduce del puerto (465).
+    """
+
+    def __init__(self, server, port, user, password, from_email, implicit_tls=None):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.from_email = from_email
+        if implicit_tls is None:
+            implicit_tls = int(port) == IMPLICIT_TLS_PORT
+        self.implicit_tls = implicit_tls
+
+
+def make_ssl_context():
+    """Contexto TLS compartido por todas las conexiones de una campaña.
+
+    Como ``smtplib`` sin contexto, no verifica el certificado del servidor; al ser
+    un único contexto, las sesiones TLS pueden reanudarse entre conexiones.
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class SenderSMTP(smtplib.SMTP):
+    """``smtplib.SMTP`` con envío en PIPELINING (RFC 2920) cuando el servidor lo anuncia.
+
+    ``starttls`` admite una sesión TLS anterior para reanudarla en lugar de hacer el
+    handshake completo; ``tls_seconds`` guarda lo que tardó el handshake.
+
+    El ``timeout`` del constructor se aplica a la conexión y al saludo del servidor;
+    ``set_timeouts`` fija después el plazo de cada comando y el de la transmisión
+    del mensaje (desde DATA hasta la respuesta final).
+    """
+
+    tls_seconds = 0.0
+    command_timeout = None
+    data_timeout = None
+    # True desde que sale el punto final del DATA: el mensaje puede haber llegado
+    data_terminated = False
+
+    def set_timeouts(self, command_timeout, data_timeout):
+        """Plazos en segundos para las respuestas a los comandos y para el DATA."""
+        self.command_timeout = command_timeout
+        self.data_timeout = data_timeout
+        self._apply_timeout(command_timeout)
+
+    def _apply_timeout(self, timeout):
+        if timeout is not None and self.sock is not None:
+            self.sock.settimeout(timeout)
+
+    def starttls(self, context=None, session=None):
+        """Como ``smtplib.SMTP.starttls``, pero reanudando ``session`` si se indica."""
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn("starttls"):
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+        code, resp = self.docmd("STARTTLS")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, resp)
+        if context is None:
+            context = make_ssl_context()
+        started = time.perf_counter()
+        self.sock = context.wrap_socket(self.sock, server_hostname=self._host, session=session)
+        self.tls_seconds = time.perf_counter() - started
+        # Hay que volver a saludar: la información anterior no es fiable tras STARTTLS
+        self.file = None
+        self.helo_resp = None
+        self.ehlo_resp = None
+        self.esmtp_features = {}
+        self.does_esmtp = False
+        return code, resp
+
+    @property
+    def tls_resumed(self):
+        """True si la sesión TLS actual se ha reanudado (handshake abreviado)."""
+        return bool(getattr(self.sock, "session_reused", False))
+
+    def mail_options(self, addresses, eightbit=True):
+        """Opciones de MAIL FROM según las extensiones que anuncia el servidor.
+
+        Devuelve ``(eightbit, opciones)``: si el cuerpo puede ir en 8bit (8BITMIME) y
+        las opciones a enviar. SMTPUTF8 solo se pide si alguna dirección no es ASCII.
+        """
+        self.ehlo_or_helo_if_needed()
+        eightbit = eightbit and self.has_extn("8bitmime")
+        options = ["BODY=8BITMIME"] if eightbit else []
+        if self.has_extn("smtputf8") and not all(addr.isascii() for addr in addresses):
+            options.append("SMTPUTF8")
+        return eightbit, options
+
+    def send_transaction(self, from_addr, to_addrs, message, mail_options=(),
+                         pipelining=True):
+        """Envía un mensaje ya serializado como ``sendmail``.
+
+        ``message`` es un ``bytes`` o una secuencia de fragmentos ``bytes`` (los que
+        devuelve ``MessageFactory`` con adjuntos), que se transmiten sin unirlos.
+
+        Con PIPELINING, MAIL FROM, todos los RCPT TO y DATA salen en un solo envío y
+        sus respuestas se leen después, en orden, así que cada destinatario conserva
+        su propio código de respuesta. Devuelve los destinatarios rechazados y lanza
+        las mismas excepciones que ``sendmail``. Si falla con ``data_terminated`` a
+        True, el servidor pudo aceptar el mensaje aunque no llegara su respuesta.
+        """
+        self.data_terminated = False
+        self.ehlo_or_helo_if_needed()
+        # Como smtplib.SMTP.mail: con SMTPUTF8 las direcciones van en UTF-8
+        smtputf8 = any(option.upper() == "SMTPUTF8" for option in mail_options)
+        self.command_encoding = "utf-8" if smtputf8 else "ascii"
+        if pipelining and self.has_extn("pipelining"):
+            refused = self._pipelined_envelope(from_addr, to_addrs, mail_options)
+        else:
+            refused = self._sequential_envelope(from_addr, to_addrs, mail_options)
+        self._send_data(message)
+        return refused
+
+    def _pipelined_envelope(self, from_addr, to_addrs, mail_options):
+        options = ""
+        if mail_options:
+            options = " " + " ".join(mail_options)
+        commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}\r\n"]
+        commands.extend(f"RCPT TO:{smtplib.quoteaddr(addr)}\r\n" for addr in to_addrs)
+        commands.append("DATA\r\n")
+        self.send("".join(commands))
+
+        mail_code, mail_resp = self.getreply()
+        refused = {}
+        for addr in to_addrs:
+            code, resp = self.getreply()
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        data_code, data_resp = self.getreply()
+
+        if data_code == 354 and (mail_code != 250 or len(refused) == len(to_addrs)):
+            # El servidor no debería aceptar DATA aquí; se cierra el mensaje vacío
+            self.send(b".\r\n")
+            self.getreply()
+        if mail_code != 250:
+            self._rset()
+            raise smtplib.SMTPSenderRefused(mail_code, mail_resp, from_addr)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            self._rset()
+            raise smtplib.SMTPDataError(data_code, data_resp)
+        return refused
+
+    def _sequential_envelope(self, from_addr, to_addrs, mail_options):
+        """MAIL FROM, RCPT TO y DATA uno tras otro, como ``sendmail``."""
+        code, resp = self.mail(from_addr, list(mail_options))
+        if code != 250:
+            if code == 421:
+                self.close()
+            else:
+                self._rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {}
+        for addr in to_addrs:
+            code, resp = self.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+            if code == 421:
+                self.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        self.putcmd("data")
+        code, resp = self.getreply()
+        if code != 354:
+            if code == 421:
+                self.close()
+            else:
+                self._rset()
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def _send_data(self, message):
+        """Transmite el contenido tras un 354 y lee la respuesta final.
+
+        Escapa los puntos a principio de línea fragmento a fragmento, salvo en los
+        ``DotSafeBytes`` (las partes de los adjuntos), que se envían tal cual. Si falla
+        la lectura de un adjunto personal se cierra la sesión.
+        """
+        line_start = True
+        pending = []
+        pending_size = 0
+        self._apply_timeout(self.data_timeout)
+        try:
+            for chunk in iter_chunks(message):
+                if not chunk:
+                    continue
+                if not isinstance(chunk, DotSafeBytes):
+                    if line_start and chunk.startswith(b"."):
+                        chunk = b"." + chunk
+                    chunk = re.sub(br"\n\.", b"\n..", chunk)
+                line_start = chunk.endswith(b"\n")
+                if len(chunk) >= DATA_CHUNK_SIZE:
+                    # Los fragmentos grandes (los adjuntos) se envían sin copiarlos
+                    if pending:
+                        self.send(b"".join(pending))
+                        pending, pending_size = [], 0
+                    self.send(chunk)
+                    continue
+                # Los pequeños se agrupan para no hacer un send por cada uno
+                pending.append(chunk)
+                pending_size += len(chunk)
+                if pending_size >= DATA_CHUNK_SIZE:
+                    self.send(b"".join(pending))
+                    pending, pending_size = [], 0
+            pending.append(b".\r\n" if line_start else b"\r\n.\r\n")
+            self.data_terminated = True
+            self.send(b"".join(pending))
+            code, resp = self.getreply()
+        except AttachmentError:
+            # El DATA no se puede cancelar a medias: se cierra la sesión
+            self.close()
+            raise
+        finally:
+            self._apply_timeout(self.command_timeout)
+        if code != 250:
+            self._rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+
+def iter_chunks(message):
+    """Fragmentos ``bytes`` de un mensaje, recorriendo los adjuntos personales."""
+    if isinstance(message, bytes):
+        yield message
+        return
+    for chunk in message:
+        if isinstance(chunk, bytes):
+            yield chunk
+        else:
+            yield from chunk
+
+
+class SenderSMTP_SSL(SenderSMTP, smtplib.SMTP_SSL):
+    """``SenderSMTP`` con TLS implícito (puerto 465) y reanudación de sesión TLS."""
+
+    def __init__(self, host, port, context, session=None, **kwargs):
+        # _get_socket se llama desde el constructor al conectar
+        self.tls_session = session
+        super().__init__(host, port, context=context, **kwargs)
+
+    def starttls(self, context=None, session=None):
+        raise smtplib.SMTPNotSupportedError("La conexión ya está cifrada.")
+
+    def _get_socket(self, host, port, timeout):
+        if self.debuglevel > 0:
+            self._print_debug("connect:", (host, port))
+        sock = socket.create_connection((host, port), timeout, self.source_address)
+        started = time.perf_counter()
+        sock = self.context.wrap_socket(sock, server_hostname=self._host,
+                                        session=self.tls_session)
+        self.tls_seconds = time.perf_counter() - started
+        return sock
+
+
+def open_session(settings, ssl_context, tls_session=None, connect_timeout=30,
+                 command_timeout=60, data_timeout=300):
+    """Abre y autentica una sesión SMTP, reanudando ``tls_session`` si se indica.
+
+    Devuelve la sesión y lo que tardaron la conexión, el handshake TLS y el login,
+    en segundos. Si algo falla, la sesión se cierra y se propaga el error.
+    """
+    started = time.perf_counter()
+    if settings.implicit_tls:
+        server = SenderSMTP_SSL(settings.server, settings.port, ssl_context,
+                                tls_session, timeout=connect_timeout)
+    else:
+        server = SenderSMTP(settings.server, settings.port, timeout=connect_timeout)
+    connected = time.perf_counter()
+    try:
+        server.set_timeouts(command_timeout, data_timeout)
+        if not settings.implicit_tls:
+            server.starttls(ssl_context, tls_session)
+        secured = time.perf_counter()
+        server.login(settings.user, settings.password)
+    except Exception:
+        server.close()
+        raise
+    # Con TLS implícito el handshake ocurre dentro del constructor
+    implicit_handshake = server.tls_seconds if settings.implicit_tls else 0.0
+    return server, (connected - started - implicit_handshake,
+                    secured - connected + implicit_handshake,
+                    time.perf_counter() - secured)
+
+
+def email_domain(email):
+    """Dominio de una dirección en minúsculas (``""`` si no tiene)."""
+    return email.rpartition("@")[2].strip().lower()
+
+
+class Watchdog:
+    """Vigila las transacciones en curso y corta las conexiones que no avanzan.
+
+    Cada conexión llama a ``busy`` antes de transmitir y a ``idle`` al terminar. Si
+    una transacción sigue en curso tras ``timeout`` segundos (un servidor que
+    responde byte a byte esquiva los plazos del socket), se cierra su socket: la
+    operación bloqueada falla como un error de conexión y ``pop_aborted`` lo indica.
+    """
+
+    def __init__(self, timeout, on_abort=None, interval=1.0):
+        self.timeout = timeout
+        self.on_abort = on_abort
+        self.interval = interval
+        # índice de conexión -> (servidor, instante de inicio)
+        self._busy = {}
+        self._aborted = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.timeout:
+            self._thread = threading.Thread(target=self._run, name="smtp-watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def busy(self, index, server):
+        with self._lock:
+            self._aborted.discard(index)
+            self._busy[index] = (server, time.monotonic())
+
+    def idle(self, index):
+        with self._lock:
+            self._busy.pop(index, None)
+
+    def pop_aborted(self, index):
+        """True (una sola vez) si el vigilante cortó la conexión ``index``."""
+        with self._lock:
+            if index in self._aborted:
+                self._aborted.discard(index)
+                return True
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                stalled = [(index, server, now - started)
+                           for index, (server, started) in self._busy.items()
+                           if now - started > self.timeout]
+                for index, _, _ in stalled:
+                    del self._busy[index]
+                    self._aborted.add(index)
+            for index, server, seconds in stalled:
+                if self.on_abort:
+                    self.on_abort(index, seconds)
+                self._abort(server)
+
+    @staticmethod
+    def _abort(server):
+        sock = server.sock
+        if sock is None:
+            return
+        try:
+            # Se cierra el descriptor sin pasar por SSLSocket, que otro hilo está usando
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# Carriles de la cola de envío: cuanto menor el número, antes sale el mensaje
+PRIORITY_TRANSACTIONAL = 0
+PRIORITY_BULK = 1
+
+
+class SendJob:
+    """Unidad de trabajo de la cola de envío: un mensaje para uno o varios destinatarios.
+
+    Solo se agrupan varios destinatarios cuando el mensaje es idéntico para todos.
+    ``priority`` es el carril de la cola y ``factory`` el ``MessageFactory`` de un
+    mensaje distinto al de la campaña (None = el de la campaña).
+    """
+
+    def __init__(self, recipients, outbox_ids=None, priority=PRIORITY_BULK, factory=None):
+        self.recipients = list(recipients)
+        # Filas de la bandeja de salida persistente (None si se envía sin bandeja)
+        self.outbox_ids = list(outbox_ids) if outbox_ids is not None else None
+        self.priority = priority
+        self.factory = factory
+        self.attempts = 0
+
+    @property
+    def emails(self):
+        return [recipient["email"] for recipient in self.recipients]
+
+    @property
+    def domain(self):
+        """Dominio de destino (todos los destinatarios de un trabajo comparten dominio)."""
+        return email_domain(self.recipients[0]["email"])
+
+    def split(self, emails):
+        """Trabajo nuevo con solo los destinatarios indicados; conserva los intentos."""
+        keep = [i for i, recipient in enumerate(self.recipients) if recipient["email"] in emails]
+        job = SendJob([self.recipients[i] for i in keep],
+                      None if self.outbox_ids is None else [self.outbox_ids[i] for i in keep],
+                      self.priority, self.factory)
+        job.attempts = self.attempts
+        return job
+
+    def describe(self):
+        """Destinatario para el log, o el número de ellos si son varios."""
+        if len(self.recipients) == 1:
+            return self.recipients[0]["email"]
+        return f"{len(self.recipients)} destinatarios"
+
+
+class _Lane:
+    """Trabajos listos de un carril: una subcola por dominio, atendidas por turnos."""
+
+    def __init__(self):
+        self.ready = {}
+        self.rotation = deque()
+        # Veces seguidas que otro carril más prioritario le ha quitado el turno
+        self.skipped = 0
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.ready.values())
+
+
+class SendQueue:
+    """Cola de trabajos compartida por las conexiones, con reintentos diferidos.
+
+    Los trabajos se reparten en una subcola por dominio de destino que se atienden
+    por turnos, para no concentrar los envíos en un solo proveedor. Opcionalmente
+    se limita cuántos trabajos de un mismo dominio hay en curso a la vez
+    (``domain_connections``) y cuántos mensajes por minuto recibe (``domain_rate``);
+    un dominio lento o que limita no bloquea a los demás.
+
+    Cada trabajo va en el carril de su ``priority`` y las conexiones toman siempre
+    del carril más prioritario con trabajos listos, así que un mensaje urgente sale
+    en cuanto termina el mensaje en curso. Para que la campaña no se quede parada,
+    un carril que pierde el turno ``starvation_limit`` veces seguidas pasa delante
+    una vez.
+
+    ``get`` devuelve el siguiente trabajo listo, espera al próximo reintento si solo
+    quedan diferidos y devuelve None cuando no queda nada por enviar ni en curso.
+    A partir de ahí (o de llamar a ``close``) la cola está terminada y ``offer`` ya
+    no admite trabajos.
+    """
+
+    def __init__(self, domain_connections=None, domain_rate=None, starvation_limit=8):
+        self.domain_connections = domain_connections
+        self.domain_rate = domain_rate
+        self.starvation_limit = max(1, int(starvation_limit))
+        # Prioridad -> carril con trabajos listos
+        self._lanes = {}
+        # Montículo de (instante, orden, trabajo) para los reintentos
+        self._delayed = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._active = {}
+        self._buckets = {}
+        self._finished = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(lane) for lane in self._lanes.values()) + len(self._delayed)
+
+    def put(self, job):
+        with self._cond:
+            self._append(job)
+            self._cond.notify()
+
+    def offer(self, jobs):
+        """Añade ``jobs`` si la cola sigue activa; devuelve False si ya terminó."""
+        with self._cond:
+            if self._finished:
+                return False
+            for job in jobs:
+                self._append(job)
+            self._cond.notify_all()
+            return True
+
+    def close(self):
+        """Termina la cola aunque queden trabajos: ya no hay quien los envíe."""
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def put_delayed(self, job, delay):
+        with self._cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._order), job))
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._append(heapq.heappop(self._delayed)[2])
+                job, wait = self._next_ready(now)
+                if job is not None:
+                    self._in_flight += 1
+                    return job
+                if not self._lanes and not self._delayed and not self._in_flight:
+                    self._finished = True
+                    return None
+                if self._delayed:
+                    delay = self._delayed[0][0] - now
+                    wait = delay if wait is None else min(wait, delay)
+                self._cond.wait(wait)
+
+    def task_done(self, job):
+        """Se llama al terminar con un trabajo obtenido con ``get``."""
+        with self._cond:
+            self._in_flight -= 1
+            self._active[job.domain] -= 1
+            self._cond.notify_all()
+
+    def _append(self, job):
+        lane = self._lanes.get(job.priority)
+        if lane is None:
+            lane = self._lanes[job.priority] = _Lane()
+        domain = job.domain
+        if domain not in lane.ready:
+            lane.ready[domain] = deque()
+            lane.rotation.append(domain)
+        lane.ready[domain].append(job)
+
+    def _next_ready(self, now):
+        """Siguiente trabajo por prioridad, o (None, segundos hasta que haya uno)."""
+        priorities = sorted(self._lanes)
+        starving = [priority for priority in priorities
+                    if self._lanes[priority].skipped >= self.starvation_limit]
+        wait = None
+        for priority in starving + [p for p in priorities if p not in starving]:
+            lane = self._lanes[priority]
+            job, lane_wait = self._next_in_lane(lane, now)
+            if job is None:
+                if lane_wait is not None:
+                    wait = lane_wait if wait is None else min(wait, lane_wait)
+                continue
+            lane.skipped = 0
+            if not lane.ready:
+                del self._lanes[priority]
+            for other, other_lane in self._lanes.items():
+                if other > priority:
+                    other_lane.skipped += 1
+            return job, None
+        return None, wait
+
+    def _next_in_lane(self, lane, now):
+        """Siguiente trabajo del carril por turno de dominio, o (None, espera)."""
+        wait = None
+        for _ in range(len(lane.rotation)):
+            domain = lane.rotation[0]
+            lane.rotation.rotate(-1)
+            if self.domain_connections and self._active.get(domain, 0) >= self.domain_connections:
+                # Queda libre cuando termine un trabajo en curso (task_done avisa)
+                continue
+            jobs = lane.ready[domain]
+            bucket = self._bucket(domain)
+            if bucket is not None:
+                bucket_wait = bucket.wait_time(now, len(jobs[0].recipients))
+                if bucket_wait > 0:
+                    wait = bucket_wait if wait is None else min(wait, bucket_wait)
+                    continue
+                bucket.consume(len(jobs[0].recipients))
+            job = jobs.popleft()
+            if not jobs:
+                del lane.ready[domain]
+                lane.rotation.remove(domain)
+            self._active[domain] = self._active.get(domain, 0) + 1
+            return job, None
+        return None, wait
+
+    def _bucket(self, domain):
+        if not self.domain_rate:
+            return None
+        if domain not in self._buckets:
+            rate = self.domain_rate / 60
+            self._buckets[domain] = TokenBucket(rate, max(1.0, rate))
+        return self._buckets[domain]
+
+
+class EmailSenderEngine:
+    """Envía una campaña repartiendo la cola de destinatarios entre N conexiones SMTP.
+
+    Los eventos de progreso se publican en ``events`` (una ``queue.Queue``) como tuplas:
+    ``("log", mensaje[, tag])``, ``("sent", email, segundos_de_transmisión)``,
+    ``("progress", enviados, fallidos, total)``, ``("rate", mensajes_por_segundo,
+    tasa_de_error)``, ``("adaptive", estado, motivo)``, ``("fatal", mensaje)`` y
+    ``("done", resumen)``. Al terminar, ``results`` tiene el resultado de cada
+    destinatario (``write_report`` lo guarda en un CSV).
+
+    Las plantillas se compilan y los adjuntos comunes se leen al crear el motor: si
+    las plantillas no son válidas se lanza ``TemplateError`` y si un adjunto no se
+    puede leer, ``OSError``, antes de abrir ninguna conexión.
+    """
+
+    def __init__(self, settings, subject, body_template, connections=1, events=None,
+                 outbox=None, campaign_id=None, rate_limits=None, recycle_after=100,
+                 max_reconnects=3, max_attempts=5, retry_delay=30, max_retry_delay=900,
+                 pipelining=True, batch_size=50, eightbit=True, ssl_context=None,
+                 connect_timeout=30, command_timeout=60, data_timeout=300, stall_timeout=600,
+                 domain_connections=None, domain_rate=None, metrics_path=None, attachments=(),
+                 attachment_patterns=(), attachments_dir=None, variables=DEFAULT_VARIABLES,
+                 adaptive=False, pool=None):
+        self.settings = settings
+        self.subject = subject
+        self.body_template = body_template
+        self.attachments = [Attachment.from_path(path) for path in attachments]
+        self.variables = tuple(variables)
+        self.factory = MessageFactory(settings.from_email, subject, body_template, variables,
+                                      attachments=self.attachments)
+        self.attachment_patterns = [AttachmentPattern(pattern, variables, attachments_dir)
+                                    for pattern in attachment_patterns]
+        # Se guardan con la campaña para reanudarla con los mismos adjuntos
+        self.attachment_settings = {
+            "attachments": [os.path.abspath(path) for path in attachments],
+            "attachment_patterns": list(attachment_patterns),
+            "attachments_dir": os.path.abspath(attachments_dir) if attachments_dir else None,
+        }
+        self._readers = None
+        # Dirección del sobre SMTP (sin el nombre visible del remitente)
+        self.envelope_from = parseaddr(settings.from_email)[1] or settings.from_email
+        self.connections = max(1, int(connections))
+        self.events = events if events is not None else queue.Queue()
+        self.outbox = outbox
+        self.campaign_id = campaign_id
+        if rate_limits is None:
+            rate_limits = limits_for_host(settings.server)
+        self.rate_limits = rate_limits
+        self.rate_limiter = RateLimiter.from_limits(rate_limits)
+        self.recycle_after = recycle_after
+        self.max_reconnects = max_reconnects
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.pipelining = pipelining
+        self.batch_size = max(1, int(batch_size))
+        self.eightbit = eightbit
+        self.pool = pool
+        # Sesiones ya autenticadas que entrega el pool al empezar la campaña
+        self._prewarmed = []
+        self.prewarmed = 0
+        if pool is not None:
+            # Mismo contexto que el pool para poder reanudar sus sesiones TLS
+            ssl_context = ssl_context or pool.ssl_context
+        self.ssl_context = ssl_context or make_ssl_context()
+        self._tls_session = None
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.data_timeout = data_timeout
+        self.watchdog = Watchdog(stall_timeout, on_abort=self._on_stalled)
+        self.domain_connections = domain_connections
+        self.domain_rate = domain_rate
+        # Se crea aquí para que ``submit`` pueda añadir trabajos antes y durante ``run``
+        self.jobs = SendQueue(domain_connections, domain_rate)
+        self.metrics = SendMetrics()
+        self.metrics_path = metrics_path
+        self.controller = None
+        if adaptive:
+            self.controller = AdaptiveController(self.connections, on_change=self._on_adaptive_change)
+        self._rate_emitted = 0.0
+        self._lock = threading.Lock()
+        # Hilos de conexión que siguen en marcha
+        self._workers = 0
+        self.total = 0
+        self.sent = 0
+        self.failed = 0
+        # Mensajes transmitidos cuya respuesta final no llegó
+        self.uncertain = 0
+        self.retried = 0
+        self.connected = 0
+        self.tls_handshakes = 0
+        self.tls_resumed = 0
+        self.tls_seconds = 0.0
+        # El servidor rechazó el usuario o la contraseña en algún momento
+        self.auth_failed = False
+        # Resultado de cada destinatario: email -> (estado, detalle)
+        self.results = {}
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def run(self, recipients):
+        """Envía a todos los destinatarios y devuelve el resumen de la campaña.
+
+        Todas las conexiones comparten un ``RateLimiter``; si no se indican
+        ``rate_limits`` se usan los límites predefinidos del proveedor del servidor.
+
+        Con ``adaptive`` un ``AdaptiveController`` (AIMD) decide además cuántas de
+        las ``connections`` conexiones envían a la vez y a qué ritmo: empieza con una
+        y los sube mientras el servidor acepta, y los reduce a la mitad ante
+        421/451/452 o si la latencia se dispara. Los límites del proveedor se siguen
+        aplicando.
+        """
+        # Sin contar lo que pasa entre crear el motor y empezar (diálogos de la interfaz)
+        self.metrics.start()
+        jobs = self.jobs
+        if self.outbox is not None:
+            pending = self._prepare_outbox(recipients)
+        else:
+            pending = self._make_jobs(recipients)
+        total = sum(len(job.recipients) for job in pending)
+        with self._lock:
+            # Puede haber ya mensajes añadidos con ``submit``
+            self.total += total
+        if total > len(pending):
+            self.emit("log", f"Mensaje sin personalizar: {total} destinatarios en "
+                             f"{len(pending)} transacciones de hasta {self.batch_size}.")
+        if self.attachment_patterns:
+            pending = self._check_attachments(pending)
+            # Los adjuntos personales se leen por adelantado en estos hilos
+            self._readers = ThreadPoolExecutor(max_workers=self.connections,
+                                               thread_name_prefix="adjuntos")
+        for job in pending:
+            jobs.put(job)
+        if self.attachments:
+            names = ", ".join(f"{a.filename} ({a.size / 1024:.0f} KB)" for a in self.attachments)
+            self.emit("log", f"Adjuntos (codificados una vez para toda la campaña): {names}")
+
+        if self.rate_limiter:
+            self.emit("log", f"Límite de envío para {self.settings.server}: {describe_limits(self.rate_limits)}")
+            if self.outbox is not None and self.rate_limits.get("per_day"):
+                # Los envíos de las últimas 24 horas cuentan para el límite diario
+                self.rate_limiter.preload("per_day", self.outbox.count_sent_since(
+                    datetime.now() - timedelta(days=1), self.settings.from_email))
+
+        if self.pool is not None:
+            if len(jobs):
+                self._take_prewarmed()
+            else:
+                # Nada que enviar (p. ej. una reanudación ya completa): nadie más cierra el pool
+                self.pool.close()
+        self.watchdog.start()
+        workers = []
+        count = min(self.connections, len(jobs)) or 1
+        with self._lock:
+            self._workers = count
+        for index in range(count):
+            worker = threading.Thread(
+                target=self._run_connection,
+                args=(index + 1, jobs),
+                name=f"smtp-{index + 1}",
+                daemon=True
+            )
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        self.watchdog.stop()
+        # Las sesiones precalentadas que no llegaron a usarse se cierran
+        for server in self._prewarmed:
+            self._close(server)
+        self._prewarmed = []
+        if self._readers is not None:
+            self._readers.shutdown(cancel_futures=True)
+        self.metrics.finish()
+        self._emit_rate(force=True)
+        # Ruta donde quedaron las métricas, o None si no se guardaron
+        metrics_saved = None
+        if self.metrics_path and self.total:
+            try:
+                self.metrics.dump(self.metrics_path)
+                metrics_saved = self.metrics_path
+            except OSError as e:
+                self.emit("log", f"No se pudieron guardar las métricas en {self.metrics_path}: {e}", "error")
+
+        summary = {
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "uncertain": self.uncertain,
+            "retried": self.retried,
+            "pending": self.total - self.sent - self.failed - self.uncertain,
+            "tls_handshakes": self.tls_handshakes,
+            "tls_resumed": self.tls_resumed,
+            "tls_seconds": round(self.tls_seconds, 3),
+            "auth_failed": self.auth_failed,
+            "metrics_path": metrics_saved,
+        }
+        if self.pool is not None:
+            summary["prewarmed"] = self.prewarmed
+        if self.controller is not None:
+            summary["adaptive"] = self.controller.state()
+        if self.outbox is not None:
+            self.outbox.finish_campaign(self.campaign_id)
+            summary["campaign_id"] = self.campaign_id
+        if self.total and not self.connected:
+            self.emit("fatal", "No se pudo establecer ninguna conexión con el servidor SMTP.")
+        self.emit("done", summary)
+        return summary
+
+    def submit(self, recipients, subject=None, body_template=None,
+               priority=PRIORITY_TRANSACTIONAL):
+        """Añade destinatarios a la campaña, en un carril más prioritario que el de esta.
+
+        Sirve para mensajes urgentes mientras se envía una campaña grande: salen en
+        cuanto una conexión termina el mensaje en curso. Con ``subject`` o
+        ``body_template`` se envía otro mensaje (sin los adjuntos de la campaña) en
+        lugar del de la campaña; si las plantillas no son válidas se lanza
+        ``TemplateError``. Devuelve False si la campaña ya ha terminado o no le queda
+        ninguna conexión. Estos mensajes no pasan por la bandeja de salida.
+        """
+        factory = None
+        if subject is not None or body_template is not None:
+            factory = MessageFactory(self.settings.from_email,
+                                     self.subject if subject is None else subject,
+                                     self.body_template if body_template is None else body_template,
+                                     self.variables)
+        jobs = [SendJob([recipient], priority=priority, factory=factory)
+                for recipient in recipients]
+        with self._lock:
+            self.total += len(jobs)
+        if not self.jobs.offer(jobs):
+            with self._lock:
+                self.total -= len(jobs)
+            return False
+        self.emit("log", f"{len(jobs)} mensajes prioritarios añadidos a la cola de envío.")
+        self.emit("progress", self.sent, self.failed, self.total)
+        return True
+
+    def _take_prewarmed(self):
+        """Recoge las sesiones abiertas por el pool si son de esta misma cuenta.
+
+        ``pool`` es un ``ConnectionPool`` (``email_pool``); sus sesiones se usan antes
+        de abrir ninguna nueva y el resumen indica cuántas en ``prewarmed``.
+        """
+        if not self.pool.matches(self.settings):
+            self.pool.close()
+            return
+        self._tls_session = self.pool.tls_session
+        sessions = self.pool.checkout()
+        self._prewarmed = sessions[:self.connections]
+        # Si se bajó el número de conexiones después de abrirlas, sobran algunas
+        for server in sessions[self.connections:]:
+            self._close(server)
+        self.prewarmed = len(self._prewarmed)
+        if self._prewarmed:
+            self.emit("log", f"Usando {self.prewarmed} conexiones ya abiertas y autenticadas.")
+
+    def _prepare_outbox(self, recipients):
+        """Guarda la campaña en la bandeja de salida y devuelve los trabajos pendientes.
+
+        Con ``campaign_id`` se reanuda esa campaña: solo se envían sus filas
+        pendientes, de modo que una campaña interrumpida no duplica envíos.
+        """
+        if self.campaign_id is None:
+            self.campaign_id = self.outbox.create_campaign(
+                self.settings.from_email, self.subject, self.body_template,
+                self.attachment_settings)
+        else:
+            interrupted = self.outbox.recover_interrupted(self.campaign_id)
+            if interrupted:
+                self.emit("log", f"{interrupted} envíos quedaron a medias en la ejecución anterior; "
+                                 "no se reenvían para evitar duplicados.", "error")
+
+        rows = []
+        for recipient in recipients:
+            subject, body = self.render(recipient)
+            rows.append((recipient, message_hash(subject, body)))
+        self.outbox.add_recipients(self.campaign_id, rows)
+
+        counts = self.outbox.count_by_status(self.campaign_id)
+        if counts.get("sent"):
+            self.emit("log", f"Reanudando campaña: {counts['sent']} correos ya enviados se omiten.")
+        if counts.get(STATUS_UNKNOWN):
+            self.emit("log", f"{counts[STATUS_UNKNOWN]} correos con resultado desconocido no se "
+                             "reenvían.", "error")
+        pending = self.outbox.pending(self.campaign_id)
+        return self._make_jobs([recipient for _, recipient in pending],
+                               [outbox_id for outbox_id, _ in pending])
+
+    def _make_jobs(self, recipients, outbox_ids=None):
+        """Agrupa los destinatarios en trabajos (varios por mensaje si no se personaliza).
+
+        Si el asunto y el cuerpo no tienen variables, el mismo mensaje se envía en una
+        sola transacción a hasta ``batch_size`` destinatarios de un mismo dominio
+        (varios RCPT TO, un único DATA, con ``To: undisclosed-recipients:;``).
+        """
+        size = self.batch_size if self.factory.is_static and not self.attachment_patterns else 1
+        if outbox_ids is None:
+            outbox_ids = [None] * len(recipients)
+        if size > 1:
+            # Cada lote va a un solo dominio para que la cola pueda repartirlos por turnos
+            groups = {}
+            for recipient, outbox_id in zip(recipients, outbox_ids):
+                groups.setdefault(email_domain(recipient["email"]), []).append((recipient, outbox_id))
+        else:
+            groups = {None: list(zip(recipients, outbox_ids))}
+        jobs = []
+        for entries in groups.values():
+            for start in range(0, len(entries), size):
+                chunk = entries[start:start + size]
+                ids = [outbox_id for _, outbox_id in chunk]
+                jobs.append(SendJob([recipient for recipient, _ in chunk],
+                                    None if ids[0] is None else ids))
+        return jobs
+
+    def preflight(self, recipients):
+        """Adjuntos personales que no existen, como ``(destinatario, ruta)``.
+
+        ``attachment_patterns`` son rutas con variables (``facturas/{client_code}.pdf``)
+        que dan a cada destinatario su propio adjunto, relativas a ``attachments_dir``.
+        ``run`` hace la misma comprobación antes de empezar y da por fallidos esos
+        destinatarios; los demás ficheros se leen por bloques al enviarlos.
+        ``variables`` son las variables admitidas (ver ``recipient_variables``).
+        """
+        return missing_attachments(self.attachment_patterns, recipients)
+
+    def _check_attachments(self, jobs):
+        """Da por fallidos los trabajos cuyo adjunto personal falta y devuelve el resto."""
+        ready = []
+        for job in jobs:
+            missing = self.preflight(job.recipients)
+            if not missing:
+                ready.append(job)
+                continue
+            error = f"Falta el adjunto {missing[0][1]}"
+            with self._lock:
+                self.failed += len(job.recipients)
+                for email in job.emails:
+                    self.results[email] = (STATUS_FAILED, error)
+            self.metrics.outcome(failed=len(job.recipients))
+            if job.outbox_ids is not None:
+                self.outbox.mark_failed(job.outbox_ids, error)
+            self.emit("log", f"No se envía a {job.describe()}: {error}", "error")
+        if len(ready) < len(jobs):
+            self.emit("progress", self.sent, self.failed, self.total)
+        return ready
+
+    def _open_attachments(self, recipient):
+        """Abre los adjuntos personales de un destinatario y empieza a leerlos."""
+        opened = []
+        try:
+            for pattern in self.attachment_patterns:
+                opened.append(FileAttachment(pattern.resolve(recipient), self._readers))
+        except AttachmentError:
+            for attachment in opened:
+                attachment.close()
+            raise
+        return opened
+
+    def connect(self):
+        """Abre y autentica una sesión SMTP, reanudando la última sesión TLS si la hay.
+
+        Si quedan sesiones precalentadas (``pool``) se usa una de ellas sin esperar.
+        """
+        with self._lock:
+            if self._prewarmed:
+                return self._prewarmed.pop()
+        try:
+            server, timings = open_session(self.settings, self.ssl_context, self._tls_session,
+                                           self.connect_timeout, self.command_timeout,
+                                           self.data_timeout)
+        except smtplib.SMTPAuthenticationError:
+            self.auth_failed = True
+            raise
+        for phase, seconds in zip(("connect", "starttls", "auth"), timings):
+            self.metrics.record(phase, seconds)
+        with self._lock:
+            self.tls_handshakes += 1
+            self.tls_resumed += server.tls_resumed
+            self.tls_seconds += server.tls_seconds
+            # Tras el login ya han llegado los tickets de sesión de TLS 1.3
+            self._tls_session = server.sock.session
+        return server
+
+    def render(self, recipient):
+        """Devuelve el asunto y el cuerpo personalizados para un destinatario."""
+        # Se reemplazan las variables {email} y {nombre} en el asunto y el cuerpo
+        return self.factory.render(recipient)
+
+    def _run_connection(self, index, jobs):
+        """Hilo de una conexión; al terminar la última se cierra la cola."""
+        try:
+            self._connection_worker(index, jobs)
+        finally:
+            with self._lock:
+                self._workers -= 1
+                last = not self._workers
+            if last:
+                # Si todas fallaron al conectar nadie atendería la cola: submit devuelve False
+                jobs.close()
+
+    def _connection_worker(self, index, jobs):
+        """Hilo de una conexión: toma trabajos de la cola compartida hasta vaciarla.
+
+        La sesión se recicla tras ``recycle_after`` mensajes (0 para no reciclar). Si
+        el servidor la corta, se restablece hasta ``max_reconnects`` veces seguidas y
+        se reintenta el mensaje que estaba en curso, salvo que ya se hubiera enviado
+        entero: entonces queda con resultado desconocido (``uncertain``).
+
+        Con control adaptativo la conexión solo se abre cuando le llega un turno, y
+        se cierra y vuelve a esperar si el controlador reduce las conexiones.
+        """
+        controller = self.controller
+        if controller is not None and not controller.acquire_slot():
+            return
+        holding = controller is not None
+        server = None
+        try:
+            try:
+                server = self.connect()
+            except Exception as e:
+                self.emit("log", f"[Conexión {index}] Error al conectar con el servidor SMTP: {e}", "error")
+                return
+            with self._lock:
+                self.connected += 1
+
+            session_count = 0
+            while True:
+                if holding and controller.should_yield():
+                    holding = False
+                    self._close(server)
+                    server = None
+                    if not controller.acquire_slot():
+                        break
+                    holding = True
+                    server = self._reconnect(index)
+                    if server is None:
+                        break
+                    session_count = 0
+
+                job = jobs.get()
+                if job is None:
+                    if controller is not None:
+                        # No queda nada: las conexiones que esperan turno pueden terminar
+                        controller.close()
+                    break
+                requeued = False
+
+                # Se recicla la sesión antes de que el servidor la corte por número de mensajes,
+                # y se reabre si se cerró a mitad de un DATA (adjunto personal ilegible)
+                if server.sock is None or (self.recycle_after
+                                           and session_count >= self.recycle_after):
+                    self._close(server)
+                    server = self._reconnect(index)
+                    session_count = 0
+
+                while server is not None:
+                    try:
+                        self._send_job(index, server, job, jobs)
+                        break
+                    except Exception as e:
+                        server.close()
+                        session_count = 0
+                        if self.watchdog.pop_aborted(index):
+                            # Conexión bloqueada: el mensaje vuelve a la cola para otra conexión
+                            self.emit("log", f"[Conexión {index}] {job.describe()} vuelve a la "
+                                             "cola; reconectando...", "error")
+                            self._requeue(jobs, job)
+                            requeued = True
+                            server = self._reconnect(index)
+                            break
+                        # Se ha perdido la conexión: se restablece y se reintenta el mismo mensaje
+                        self.emit("log", f"[Conexión {index}] Conexión perdida ({e}); reconectando...", "error")
+                        server = self._reconnect(index)
+                if server is None:
+                    # No se pudo reconectar: el mensaje vuelve a la cola para otra conexión
+                    if not requeued:
+                        self._requeue(jobs, job)
+                    jobs.task_done(job)
+                    break
+                session_count += 1
+                jobs.task_done(job)
+        finally:
+            if server is not None:
+                self._close(server)
+            if holding:
+                controller.release_slot()
+
+    def _reconnect(self, index):
+        """Intenta abrir una sesión nueva con esperas crecientes; devuelve None si no lo logra."""
+        error = None
+        for attempt in range(max(1, self.max_reconnects)):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            try:
+                return self.connect()
+            except Exception as e:
+                error = e
+        self.emit("log", f"[Conexión {index}] No se pudo reconectar: {error}", "error")
+        return None
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _requeue(self, jobs, job):
+        if job.outbox_ids is not None:
+            self.outbox.mark_pending(job.outbox_ids)
+        jobs.put(job)
+
+    def _on_stalled(self, index, seconds):
+        self.emit("log", f"[Conexión {index}] Sin respuesta del servidor tras {seconds:.0f} s; "
+                         "se corta la conexión.", "error")
+
+    def _on_adaptive_change(self, state, reason):
+        self.emit("adaptive", state, reason)
+        if reason != "sin saturación":
+            self.emit("log", f"Control adaptativo ({reason}): {state['connections']} conexiones, "
+                             f"{state['rate']:g} msg/s", "error")
+
+    def _on_rate_wait(self, seconds):
+        self.emit("log", f"Límite de envío del proveedor alcanzado; esperando {seconds:.0f} s...")
+
+    def _retry_delay_for(self, job):
+        """Espera exponencial con jitter antes de reintentar un error temporal.
+
+        ``retry_delay`` * 2^n, hasta ``max_retry_delay``; las respuestas 5xx no se
+        reintentan y un mensaje se intenta como mucho ``max_attempts`` veces.
+        """
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (job.attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _send_job(self, index, server, job, jobs):
+        """Envía un trabajo; relanza los errores de conexión para que se reintente."""
+        emails = job.emails
+        job.attempts += 1
+        personal = []
+        factory = job.factory or self.factory
+        try:
+            if self.attachment_patterns and job.factory is None:
+                # La lectura del disco avanza mientras se prepara y se abre la transacción
+                personal = self._open_attachments(job.recipients[0])
+            eightbit, mail_options = server.mail_options([self.envelope_from] + emails,
+                                                         self.eightbit)
+            if len(job.recipients) == 1:
+                recipient = job.recipients[0]
+                with self.metrics.timer("render"):
+                    subject, body = factory.render(recipient)
+                with self.metrics.timer("serialize"):
+                    message = factory.serialize(recipient, subject, body, eightbit, personal)
+            else:
+                with self.metrics.timer("serialize"):
+                    message = factory.build_batch(eightbit)
+            if self.rate_limiter:
+                self.rate_limiter.acquire(len(emails), on_wait=self._on_rate_wait)
+            if self.controller is not None:
+                self.controller.wait_rate(len(emails))
+            if job.outbox_ids is not None:
+                self.outbox.mark_sending(job.outbox_ids)
+            started = time.perf_counter()
+            self.watchdog.busy(index, server)
+            try:
+                refused = server.send_transaction(self.envelope_from, emails, message,
+                                                  mail_options, pipelining=self.pipelining)
+            finally:
+                self.watchdog.idle(index)
+            elapsed = time.perf_counter() - started
+            self.metrics.record("transmit", elapsed)
+        except Exception as exc:
+            for attachment in personal:
+                attachment.close()
+            if self.controller is not None:
+                for code in reply_codes(exc):
+                    self.controller.on_reply(code)
+            kind = classify_error(exc)
+            if kind == "connection" and server.data_terminated:
+                # Se perdió la respuesta al DATA: reenviarlo podría duplicar el mensaje
+                server.close()
+                self.watchdog.pop_aborted(index)
+                self._job_uncertain(index, job, exc)
+                self.emit("progress", self.sent, self.failed, self.total)
+                self._emit_rate()
+                return
+            if kind == "connection" and job.attempts < self.max_attempts:
+                raise
+            if kind != "connection" and isinstance(exc, smtplib.SMTPRecipientsRefused):
+                # Se rechazaron todos, pero cada uno con su propia respuesta
+                refused, elapsed = exc.recipients, None
+            else:
+                self._job_error(index, job, jobs, exc)
+                self.emit("progress", self.sent, self.failed, self.total)
+                self._emit_rate()
+                return
+
+        accepted = [email for email in emails if email not in refused]
+        if self.controller is not None:
+            if accepted and elapsed is not None:
+                self.controller.on_success(elapsed, len(accepted))
+            for code, _ in refused.values():
+                self.controller.on_reply(code)
+        if accepted:
+            self._job_sent(job.split(accepted), elapsed)
+        # Los rechazos temporales vuelven juntos a la cola; los definitivos, uno a uno
+        transient = {email: reply for email, reply in refused.items() if 400 <= reply[0] < 500}
+        if transient:
+            self._job_error(index, job.split(transient), jobs,
+                            smtplib.SMTPRecipientsRefused(transient))
+        for email, reply in refused.items():
+            if email not in transient:
+                self._job_error(index, job.split([email]), jobs,
+                                smtplib.SMTPRecipientsRefused({email: reply}))
+        self.emit("progress", self.sent, self.failed, self.total)
+        self._emit_rate()
+
+    def _emit_rate(self, force=False):
+        """Publica el ritmo de envío reciente, como mucho una vez por segundo.
+
+        ``metrics`` (``SendMetrics``) mide además cada fase (conexión, STARTTLS,
+        AUTH, render, serialización y transmisión); al terminar, ``run`` guarda su
+        resumen en ``metrics_path`` si se indica y lo indica en el resumen de la
+        campaña (``metrics_path`` es None si no se guardó).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._rate_emitted < 1.0:
+                return
+            self._rate_emitted = now
+        per_second, error_rate = self.metrics.live()
+        self.emit("rate", per_second, error_rate)
+
+    def _job_sent(self, job, elapsed):
+        emails = job.emails
+        with self._lock:
+            self.sent += len(emails)
+            for email in emails:
+                self.results[email] = (STATUS_SENT, "")
+        self.metrics.outcome(sent=len(emails))
+        if job.outbox_ids is not None:
+            self.outbox.mark_sent(job.outbox_ids)
+        self.emit("log", f"Correo enviado a: {', '.join(emails)}", "success")
+        for email in emails:
+            self.emit("sent", email, elapsed)
+
+    def _job_uncertain(self, index, job, exc):
+        """La conexión se perdió tras enviar el mensaje entero: no se reintenta."""
+        error = f"Resultado desconocido: conexión perdida tras el DATA ({describe_error(exc)})"
+        with self._lock:
+            self.uncertain += len(job.recipients)
+            for email in job.emails:
+                self.results[email] = (STATUS_UNKNOWN, error)
+        if job.outbox_ids is not None:
+            self.outbox.mark_unknown(job.outbox_ids, error)
+        self.emit("log", f"[Conexión {index}] {job.describe()}: {error}; no se reenvía "
+                         "para evitar duplicados.", "error")
+
+    def _job_error(self, index, job, jobs, exc):
+        """Reintenta más tarde los errores temporales y da por fallidos los demás."""
+        error = describe_error(exc)
+        kind = classify_error(exc)
+        if kind in ("transient", "connection") and job.attempts < self.max_attempts:
+            delay = self._retry_delay_for(job)
+            with self._lock:
+                self.retried += len(job.recipients)
+            if job.outbox_ids is not None:
+                self.outbox.mark_retry(job.outbox_ids, error)
+            jobs.put_delayed(job, delay)
+            self.emit("log", f"[Conexión {index}] Error temporal al enviar a {job.describe()} "
+                             f"({error}); reintento {job.attempts + 1} en {delay:.0f} s")
+            return
+        with self._lock:
+            self.failed += len(job.recipients)
+            for email in job.emails:
+                self.results[email] = (STATUS_FAILED, error)
+        self.metrics.outcome(failed=len(job.recipients))
+        if job.outbox_ids is not None:
+            self.outbox.mark_failed(job.outbox_ids, error)
+        self.emit("log", f"[Conexión {index}] Error al enviar a {job.describe()}: {error}", "error")
@@ -0,0 +1,433 @@
+"""Plantillas compiladas y construcción de mensajes para envioemail."""
+import binascii
+import mimetypes
+import mmap
+import os
+import random
+import string
+import sys
+import threading
+from collections import deque
+from email.header import Header
+from email.utils import encode_rfc2231
+
+# Variables disponibles en el asunto y el cuerpo del email
+DEFAULT_VARIABLES = ("email", "nombre")
+
+CRLF = "\r\n"
+
+# RFC 5322: una línea no puede superar 998 octetos sin contar el CRLF
+MAX_LINE_LENGTH = 998
+
+# Caracteres base64 por línea (RFC 2045)
+BASE64_LINE_LENGTH = 76
+
+# Bytes que se leen de cada adjunto personal de una vez: 1024 líneas base64 completas
+ATTACHMENT_BLOCK_SIZE = 57 * 1024
+
+
+class TemplateError(ValueError):
+    """Plantilla de asunto o cuerpo no válida."""
+
+
+class AttachmentError(Exception):
+    """No se pudo leer el adjunto personal de un destinatario."""
+
+
+def recipient_variables(recipients):
+    """Variables disponibles: ``{email}``, ``{nombre}`` y las demás columnas del CSV."""
+    names = list(DEFAULT_VARIABLES)
+    seen = set(names)
+    for recipient in recipients:
+        for key in recipient:
+            if key not in seen and key.isidentifier():
+                seen.add(key)
+                names.append(key)
+    return tuple(names)
+
+
+def template_context(recipient):
+    """Valores de las variables para un destinatario ({nombre} usa el email si falta)."""
+    context = dict(recipient)
+    context["nombre"] = recipient.get("nombre") or recipient["email"]
+    return context
+
+
+class CompiledTemplate:
+    """Plantilla con sintaxis de ``str.format`` analizada y validada una sola vez.
+
+    Al compilar se separan los literales de las variables y se precalcula la
+    posición de cada hueco; renderizar es rellenar los huecos y hacer un ``join``.
+    """
+
+    def __init__(self, text, variables=DEFAULT_VARIABLES, name="plantilla"):
+        self.text = text
+        self.name = name
+        self._parts = []
+        # (posición en _parts, variable, conversión, formato)
+        self._slots = []
+        self.variables = set()
+
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"La {name} no es válida: {e}. Usa {{{{ y }}}} para escribir llaves.")
+
+        allowed = set(variables)
+        for literal, field, format_spec, conversion in parsed:
+            if literal:
+                self._parts.append(literal)
+            if field is None:
+                continue
+            if field == "" or not field.isidentifier():
+                raise TemplateError(
+                    f"La {name} contiene una variable no válida: {{{field}}}. "
+                    "Usa {{ y }} para escribir llaves."
+                )
+            if field not in allowed:
+                raise TemplateError(
+                    f"La {name} usa la variable desconocida {{{field}}}. "
+                    f"Variables disponibles: {', '.join('{' + v + '}' for v in sorted(allowed))}"
+                )
+            if format_spec and "{" in format_spec:
+                raise TemplateError(f"La {name} usa un formato anidado no soportado en {{{field}}}.")
+            if conversion not in (None, "s", "r", "a"):
+                raise TemplateError(f"La {name} usa una conversión no válida en {{{field}}}.")
+            self._slots.append((len(self._parts), field, conversion, format_spec or ""))
+            self._parts.append("")
+            self.variables.add(field)
+
+        # Comprobar los formatos con un valor de prueba para detectar errores ahora
+        for _, field, conversion, format_spec in self._slots:
+            try:
+                self._format_value("", conversion, format_spec)
+            except ValueError as e:
+                raise TemplateError(f"La {name} tiene un formato no válido en {{{field}}}: {e}")
+
+        self.is_static = not self._slots
+        self._static_text = "".join(self._parts) if self.is_static else None
+
+    @staticmethod
+    def _format_value(value, conversion, format_spec):
+        if conversion == "r":
+            value = repr(value)
+        elif conversion == "a":
+            value = ascii(value)
+        elif conversion == "s":
+            value = str(value)
+        if format_spec:
+            return format(value, format_spec)
+        return str(value)
+
+    def render(self, context):
+        """Devuelve el texto con las variables sustituidas por los valores de ``context``."""
+        if self.is_static:
+            return self._static_text
+        parts = self._parts[:]
+        for position, field, conversion, format_spec in self._slots:
+            value = context.get(field, "")
+            if conversion is None and not format_spec:
+                parts[position] = str(value)
+            else:
+                parts[position] = self._format_value(value, conversion, format_spec)
+        return "".join(parts)
+
+
+def compile_template(text, variables=DEFAULT_VARIABLES, name="plantilla"):
+    """Compila una plantilla o lanza ``TemplateError`` si no es válida."""
+    return CompiledTemplate(text, variables, name)
+
+
+def encode_header(name, value):
+    """Codifica y pliega una cabecera igual que ``email`` con la política compat32."""
+    try:
+        value.encode("ascii")
+        header = Header(value, header_name=name)
+    except UnicodeEncodeError:
+        header = Header(value, "utf-8", header_name=name)
+    return f"{name}: {header.encode(linesep=CRLF)}{CRLF}".encode("ascii")
+
+
+def make_boundary():
+    """Boundary con el mismo formato que genera el paquete ``email``."""
+    return "=" * 15 + str(random.randrange(sys.maxsize)) + "=="
+
+
+def encode_text_part(body, eightbit=False):
+    """Cabeceras y contenido codificado de la parte ``text/plain`` del mensaje.
+
+    El texto ASCII va en 7bit. El resto va en UTF-8 tal cual (8bit) si ``eightbit``
+    (el servidor anuncia 8BITMIME) y ninguna línea es demasiado larga, o en
+    quoted-printable si no: en un texto en español solo crecen las letras acentuadas,
+    mientras que base64 aumenta todo el cuerpo en un tercio.
+    """
+    text = body.replace("\r\n", "\n")
+    try:
+        data = text.encode("ascii")
+        charset, encoding = "us-ascii", "7bit"
+    except UnicodeEncodeError:
+        data = text.encode("utf-8")
+        charset, encoding = "utf-8", "quoted-printable"
+        if eightbit and all(len(line) <= MAX_LINE_LENGTH for line in data.split(b"\n")):
+            encoding = "8bit"
+        else:
+            data = binascii.b2a_qp(data, istext=True)
+    headers = (f'Content-Type: text/plain; charset="{charset}"\r\n'
+               "MIME-Version: 1.0\r\n"
+               f"Content-Transfer-Encoding: {encoding}\r\n\r\n").encode("ascii")
+    return headers + data.replace(b"\n", b"\r\n")
+
+
+class DotSafeBytes(bytes):
+    """Bytes en los que ninguna línea empieza por ``.``: se transmiten sin escaparlos."""
+
+
+def message_bytes(message):
+    """Mensaje completo como ``bytes``, tanto si viene entero como en fragmentos.
+
+    Los fragmentos que no son ``bytes`` (adjuntos personales) se recorren a su vez.
+    """
+    if isinstance(message, bytes):
+        return message
+    return b"".join(chunk if isinstance(chunk, bytes) else b"".join(chunk)
+                    for chunk in message)
+
+
+def encode_base64_lines(data):
+    """Base64 en líneas de 76 caracteres terminadas en CRLF."""
+    encoded = binascii.b2a_base64(data, newline=False)
+    return b"".join(encoded[start:start + BASE64_LINE_LENGTH] + b"\r\n"
+                    for start in range(0, len(encoded), BASE64_LINE_LENGTH))
+
+
+def attachment_headers(filename):
+    """Tipo MIME y cabeceras (terminadas en línea en blanco) de la parte de un adjunto."""
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if filename.isascii():
+        quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+        disposition = f'attachment; filename="{quoted}"'
+    else:
+        disposition = "attachment; filename*=" + encode_rfc2231(filename, "utf-8")
+    headers = (f"Content-Type: {content_type}\r\n"
+               "MIME-Version: 1.0\r\n"
+               "Content-Transfer-Encoding: base64\r\n"
+               f"Content-Disposition: {disposition}\r\n\r\n").encode("ascii")
+    return content_type, headers
+
+
+class Attachment:
+    """Fichero adjunto leído y codificado en base64 una sola vez por campaña.
+
+    ``part`` contiene la parte MIME completa (cabeceras y contenido). Los mensajes
+    de la campaña no la copian: la incluyen por referencia como un fragmento más.
+    """
+
+    def __init__(self, filename, content_type, part, size):
+        self.filename = filename
+        self.content_type = content_type
+        self.part = DotSafeBytes(part)
+        self.size = size
+
+    @classmethod
+    def from_path(cls, path, filename=None):
+        """Lee el fichero (proyectado en memoria) y lo codifica; lanza ``OSError``."""
+        filename = filename or os.path.basename(path)
+        content_type, headers = attachment_headers(filename)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    encoded = encode_base64_lines(data)
+            else:
+                encoded = b""
+        return cls(filename, content_type, headers + encoded, size)
+
+
+class AttachmentPattern:
+    """Ruta de un adjunto personal con variables del destinatario.
+
+    Por ejemplo ``facturas/{client_code}.pdf`` adjunta a cada cliente su factura. Las
+    rutas relativas se resuelven desde ``base_dir`` (o el directorio actual).
+    """
+
+    def __init__(self, pattern, variables=DEFAULT_VARIABLES, base_dir=None):
+        self.pattern = pattern
+        self.template = compile_template(pattern, variables, "ruta del adjunto")
+        self.base_dir = base_dir
+
+    def resolve(self, recipient):
+        path = self.template.render(template_context(recipient))
+        if self.base_dir:
+            path = os.path.join(self.base_dir, path)
+        return path
+
+
+def missing_attachments(patterns, recipients):
+    """Comprobación previa: ``(destinatario, ruta)`` de cada adjunto personal que no existe."""
+    missing = []
+    for recipient in recipients:
+        for pattern in patterns:
+            path = pattern.resolve(recipient)
+            if not os.path.isfile(path):
+                missing.append((recipient, path))
+    return missing
+
+
+class FileAttachment:
+    """Adjunto personal que se lee del disco y se codifica por bloques al transmitirlo.
+
+    Nunca hay más de ``lookahead`` bloques en memoria. Con un ``executor`` los
+    bloques se leen por adelantado en otro hilo desde que se crea el objeto, de modo
+    que la lectura del disco se solapa con el resto del envío. Se recorre una sola
+    vez; los errores de lectura se lanzan como ``AttachmentError``.
+    """
+
+    def __init__(self, path, executor=None, lookahead=4):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.content_type, self.headers = attachment_headers(self.filename)
+        self.executor = executor
+        self.lookahead = max(1, lookahead)
+        try:
+            self._file = open(path, "rb")
+            self.size = os.fstat(self._file.fileno()).st_size
+        except OSError as e:
+            raise AttachmentError(f"No se pudo abrir el adjunto {path}: {e}") from e
+        self._lock = threading.Lock()
+        # Bloques pendientes: futuros si hay executor, índices si no
+        self._blocks = deque()
+        self._next_block = 0
+        self._fill()
+
+    def __iter__(self):
+        try:
+            yield DotSafeBytes(self.headers)
+            while self._blocks:
+                block = self._blocks.popleft()
+                data = block.result() if self.executor is not None else self._read_block(block)
+                self._fill()
+                yield data
+        finally:
+            self.close()
+
+    def close(self):
+        for block in self._blocks:
+            if self.executor is not None:
+                block.cancel()
+        self._blocks.clear()
+        with self._lock:
+            self._file.close()
+
+    def _fill(self):
+        while (len(self._blocks) < self.lookahead
+               and self._next_block * ATTACHMENT_BLOCK_SIZE < self.size):
+            index = self._next_block
+            self._next_block += 1
+            if self.executor is not None:
+                self._blocks.append(self.executor.submit(self._read_block, index))
+            else:
+                self._blocks.append(index)
+
+    def _read_block(self, index):
+        try:
+            with self._lock:
+                self._file.seek(index * ATTACHMENT_BLOCK_SIZE)
+                data = self._file.read(ATTACHMENT_BLOCK_SIZE)
+        except (OSError, ValueError) as e:
+            raise AttachmentError(f"No se pudo leer el adjunto {self.path}: {e}") from e
+        return DotSafeBytes(encode_base64_lines(data))
+
+
+class MessageFactory:
+    """Genera los bytes de cada mensaje a partir de un esqueleto MIME precalculado.
+
+    Las cabeceras fijas, el boundary y (si el cuerpo no tiene variables) la parte de
+    texto codificada se serializan una vez por campaña. Para cada destinatario solo
+    se añaden la cabecera ``To``, el asunto si es personalizado y el cuerpo. La
+    estructura es la de ``MIMEMultipart`` + ``MIMEText(cuerpo, "plain")``, pero los
+    cuerpos no ASCII van en 8bit (``eightbit``) o quoted-printable en vez de base64.
+
+    Sin adjuntos cada mensaje es un ``bytes``. Con ``attachments`` (objetos
+    ``Attachment``) es una tupla de fragmentos: la parte personalizada, las partes
+    de los adjuntos, que son los mismos objetos en todos los mensajes, y el cierre.
+    Los adjuntos personales (``FileAttachment``) que se pasen a ``serialize`` o
+    ``build`` se añaden como fragmentos que se leen del disco al transmitirlos.
+    """
+
+    def __init__(self, from_email, subject, body_template, variables=DEFAULT_VARIABLES,
+                 attachments=()):
+        self.from_email = from_email
+        self.attachments = list(attachments)
+        self.subject = compile_template(subject, variables, "plantilla del asunto")
+        self.body = compile_template(body_template, variables, "plantilla del cuerpo")
+
+        boundary = make_boundary().encode("ascii")
+        self._head = (
+            b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n'
+            b"MIME-Version: 1.0\r\n"
+            + encode_header("From", from_email)
+        )
+        self._part_open = b"\r\n--" + boundary + b"\r\n"
+        self._tail = b"\r\n--" + boundary + b"--\r\n"
+        self._attachment_chunks = tuple(DotSafeBytes(self._part_open + attachment.part)
+                                        for attachment in self.attachments)
+        self._static_subject = (encode_header("Subject", self.subject.render({}))
+                                if self.subject.is_static else None)
+        # Parte de texto ya codificada, sin y con 8BITMIME
+        self._static_parts = ({eightbit: encode_text_part(self.body.render({}), eightbit)
+                               for eightbit in (False, True)}
+                              if self.body.is_static else None)
+        self._batch_messages = {}
+
+    @property
+    def is_static(self):
+        """True si asunto y cuerpo son iguales para todos los destinatarios."""
+        return self.subject.is_static and self.body.is_static
+
+    def render(self, recipient):
+        """Devuelve el asunto y el cuerpo personalizados para un destinatario."""
+        context = template_context(recipient)
+        return self.subject.render(context), self.body.render(context)
+
+    def serialize(self, recipient, subject, body, eightbit=False, personal=()):
+        """Mensaje listo para enviar con el asunto y cuerpo ya renderizados.
+
+        Es un ``bytes`` o, con adjuntos, una tupla de fragmentos (ver ``message_bytes``).
+        """
+        subject_header = self._static_subject or encode_header("Subject", subject)
+        if self._static_parts:
+            text_part = self._static_parts[eightbit]
+        else:
+            text_part = encode_text_part(body, eightbit)
+        return self._assemble(encode_header("To", recipient["email"]), subject_header, text_part,
+                              personal)
+
+    def _assemble(self, to_header, subject_header, text_part, personal=()):
+        parts = (self._head, to_header, subject_header, self._part_open, text_part)
+        if not self._attachment_chunks and not personal:
+            return b"".join(parts + (self._tail,))
+        chunks = [b"".join(parts), *self._attachment_chunks]
+        for attachment in personal:
+            chunks.append(DotSafeBytes(self._part_open))
+            chunks.append(attachment)
+        chunks.append(self._tail)
+        return tuple(chunks)
+
+    def build(self, recipient, eightbit=False, personal=()):
+        """Renderiza y serializa el mensaje de un destinatario."""
+        subject, body = self.render(recipient)
+        return self.serialize(recipient, subject, body, eightbit, personal)
+
+    def build_batch(self, eightbit=False):
+        """Mensaje único para enviar a varios destinatarios en la misma transacción.
+
+        Solo es válido si ``is_static``. La cabecera ``To`` no lista a nadie para que
+        los destinatarios no vean las direcciones de los demás.
+        """
+        if eightbit not in self._batch_messages:
+            self._batch_messages[eightbit] = self._assemble(
+                b"To: undisclosed-recipients:;\r\n",
+                self._static_subject,
+                self._static_parts[eightbit],
+            )
+        return self._batch_messages[eightbit]
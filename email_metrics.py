@@ -0,0 +1,161 @@
+"""Métricas de envío: tiempos por fase en histogramas y ritmo de envío en vivo."""
+import bisect
+import json
+import math
+import threading
+import time
+from collections import deque
+
+# Fases medidas: las tres primeras una vez por conexión, el resto una vez por mensaje
+PHASES = ("connect", "starttls", "auth", "render", "serialize", "transmit")
+
+# Límites superiores de los intervalos del histograma: de 10 µs a ~20 min, +25 % cada uno
+BUCKET_BOUNDS = tuple(1e-5 * 1.25 ** i for i in range(int(math.log(1.2e8, 1.25)) + 1))
+
+
+class Histogram:
+    """Histograma de duraciones en intervalos logarítmicos.
+
+    Guarda recuento, suma, mínimo y máximo exactos; los percentiles se estiman con
+    el centro geométrico del intervalo (error de ±12 %), sin guardar muestras.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * fraction))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == 0 or index == len(BUCKET_BOUNDS):
+                    return self.min if index == 0 else self.max
+                estimate = math.sqrt(BUCKET_BOUNDS[index - 1] * BUCKET_BOUNDS[index])
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def as_dict(self):
+        """Resumen en milisegundos."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3),
+            "min_ms": round(self.min * 1000, 3),
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p90_ms": round(self.percentile(0.90) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class SendMetrics:
+    """Métricas de una campaña, compartidas por todas las conexiones.
+
+    ``record`` añade una duración a la fase indicada y ``outcome`` anota el
+    resultado de cada destinatario; ``live`` calcula mensajes por segundo y tasa de
+    error en los últimos ``window`` segundos.
+    """
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.sent = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+        # (instante, enviados, fallidos) de los resultados recientes
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            self.phases[phase].add(seconds)
+
+    def timer(self, phase):
+        """Context manager que mide el bloque y lo añade a ``phase``."""
+        return _PhaseTimer(self, phase)
+
+    def outcome(self, sent=0, failed=0):
+        now = time.monotonic()
+        with self._lock:
+            self.sent += sent
+            self.failed += failed
+            self._recent.append((now, sent, failed))
+            self._trim(now)
+
+    def live(self):
+        """(mensajes por segundo, fracción de errores) en la ventana reciente."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            sent = sum(item[1] for item in self._recent)
+            failed = sum(item[2] for item in self._recent)
+        span = min(self.window, max(now - self.started, 1e-9))
+        done = sent + failed
+        return sent / span, (failed / done if done else 0.0)
+
+    def start(self):
+        """Marca el comienzo del envío (el objeto puede crearse bastante antes)."""
+        self.started = time.monotonic()
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def summary(self):
+        end = self.finished or time.monotonic()
+        elapsed = end - self.started
+        with self._lock:
+            phases = {phase: histogram.as_dict() for phase, histogram in self.phases.items()}
+            sent, failed = self.sent, self.failed
+        done = sent + failed
+        return {
+            "seconds": round(elapsed, 3),
+            "sent": sent,
+            "failed": failed,
+            "msgs_per_second": round(sent / elapsed, 2) if elapsed else 0.0,
+            "error_rate": round(failed / done, 4) if done else 0.0,
+            "phases": phases,
+        }
+
+    def dump(self, path):
+        """Escribe el resumen en ``path`` como JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0][0] > self.window:
+            self._recent.popleft()
+
+
+class _PhaseTimer:
+    __slots__ = ("metrics", "phase", "started")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Solo se miden las fases que terminan bien
+        if exc_type is None:
+            self.metrics.record(self.phase, time.perf_counter() - self.started)
+        return False
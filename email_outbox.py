@@ -0,0 +1,245 @@
+"""Bandeja de salida persistente (SQLite) para reanudar envíos interrumpidos."""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+
+def get_application_path():
+    """Obtiene la ruta base de la aplicación, ya sea en modo desarrollo o ejecutable"""
+    if getattr(sys, 'frozen', False):
+        # Si estamos en un ejecutable creado con PyInstaller
+        return os.path.dirname(sys.executable)
+    else:
+        # En modo desarrollo
+        return os.path.dirname(os.path.abspath(__file__))
+
+
+def campaign_key(from_email, subject, body_template, attachments=None):
+    """Identifica una campaña por su remitente, sus plantillas y sus adjuntos.
+
+    ``attachments`` es el diccionario ``attachment_settings`` del motor; sin
+    adjuntos la clave es la misma que la de las campañas guardadas sin ellos.
+    """
+    parts = [from_email, subject, body_template]
+    if attachments and (attachments["attachments"] or attachments["attachment_patterns"]):
+        parts.append(json.dumps(attachments, sort_keys=True))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def message_hash(subject, body):
+    """Huella del mensaje ya personalizado para un destinatario."""
+    return hashlib.sha256((subject + "\0" + body).encode("utf-8")).hexdigest()
+
+
+# Estados de una fila de la bandeja de salida
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+# El proceso murió o se perdió la conexión durante la transmisión: no se reenvía
+STATUS_UNKNOWN = "unknown"
+
+
+class OutboxManager:
+    """Guarda cada campaña y el estado de envío de cada destinatario.
+
+    El motor marca la fila como ``sending`` antes de transmitir y como ``sent`` o
+    ``failed`` al terminar, así que al reanudar solo se envían las filas pendientes.
+    """
+
+    def __init__(self, db_path="envio_outbox.db"):
+        # La base de datos se crea en la misma carpeta que la aplicación
+        self.db_path = os.path.join(get_application_path(), db_path)
+        self.conn = None
+        # La conexión se comparte entre los hilos del motor de envío
+        self._lock = threading.Lock()
+        self.create_database()
+
+    def create_database(self):
+        """Crea la base de datos si no existe y configura las tablas necesarias."""
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id INTEGER PRIMARY KEY,
+            campaign_key TEXT,
+            created_date TEXT,
+            from_email TEXT,
+            subject TEXT,
+            body_template TEXT,
+            status TEXT,
+            attachments TEXT
+        )
+        ''')
+        # Las bases de datos anteriores no tienen la columna de adjuntos
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(campaigns)")]
+        if "attachments" not in columns:
+            cursor.execute("ALTER TABLE campaigns ADD COLUMN attachments TEXT")
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            campaign_id INTEGER,
+            email TEXT,
+            data TEXT,
+            message_hash TEXT,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            updated_date TEXT,
+            UNIQUE (campaign_id, email, message_hash)
+        )
+        ''')
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (campaign_id, status)"
+        )
+        self.conn.commit()
+
+    def close_connection(self):
+        """Cierra la conexión a la base de datos."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def _now(self):
+        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def find_unfinished_campaign(self, key=None):
+        """Devuelve la última campaña activa (opcionalmente con esa clave) o None.
+
+        ``attachments`` es el ``attachment_settings`` con que se creó (None si no
+        se guardó).
+        """
+        query = ("SELECT id, from_email, subject, body_template, attachments FROM campaigns "
+                 "WHERE status = 'active'")
+        params = ()
+        if key is not None:
+            query += " AND campaign_key = ?"
+            params = (key,)
+        with self._lock:
+            row = self.conn.execute(query + " ORDER BY id DESC LIMIT 1", params).fetchone()
+        if not row:
+            return None
+        return {"id": row[0], "from_email": row[1], "subject": row[2], "body_template": row[3],
+                "attachments": json.loads(row[4]) if row[4] else None}
+
+    def create_campaign(self, from_email, subject, body_template, attachments=None):
+        """Registra una campaña nueva y devuelve su id."""
+        key = campaign_key(from_email, subject, body_template, attachments)
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO campaigns (campaign_key, created_date, from_email, subject, body_template, "
+                "status, attachments) VALUES (?, ?, ?, ?, ?, 'active', ?)",
+                (key, self._now(), from_email, subject, body_template,
+                 json.dumps(attachments, ensure_ascii=False) if attachments else None)
+            )
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def cancel_campaign(self, campaign_id):
+        """Descarta una campaña interrumpida que no se va a reanudar."""
+        self._set_campaign_status(campaign_id, "cancelled")
+
+    def finish_campaign(self, campaign_id):
+        """Marca la campaña como terminada si no le quedan filas pendientes."""
+        if not self.count_by_status(campaign_id).get(STATUS_PENDING):
+            self._set_campaign_status(campaign_id, "completed")
+
+    def _set_campaign_status(self, campaign_id, status):
+        with self._lock:
+            self.conn.execute("UPDATE campaigns SET status = ? WHERE id = ?", (status, campaign_id))
+            self.conn.commit()
+
+    def add_recipients(self, campaign_id, rows):
+        """Añade destinatarios ``(diccionario, hash)``; los que ya estaban se ignoran."""
+        now = self._now()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox (campaign_id, email, data, message_hash, status, updated_date) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(campaign_id, recipient["email"], json.dumps(recipient, ensure_ascii=False), digest, now)
+                 for recipient, digest in rows]
+            )
+            self.conn.commit()
+
+    def recover_interrupted(self, campaign_id):
+        """Pasa a ``unknown`` las filas que estaban transmitiéndose cuando se cortó el proceso."""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE outbox SET status = ?, last_error = ?, updated_date = ? "
+                "WHERE campaign_id = ? AND status = ?",
+                (STATUS_UNKNOWN, "Envío interrumpido durante la transmisión", self._now(),
+                 campaign_id, STATUS_SENDING)
+            )
+            self.conn.commit()
+            return cursor.rowcount
+
+    def pending(self, campaign_id):
+        """Filas pendientes de envío como ``(id, destinatario)``."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, data FROM outbox WHERE campaign_id = ? AND status = ? ORDER BY id",
+                (campaign_id, STATUS_PENDING)
+            ).fetchall()
+        return [(outbox_id, json.loads(data)) for outbox_id, data in rows]
+
+    def count_by_status(self, campaign_id):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM outbox WHERE campaign_id = ? GROUP BY status",
+                (campaign_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def count_sent_since(self, since, from_email):
+        """Envíos hechos desde ``since`` (datetime) con ese remitente, en cualquier campaña."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM outbox JOIN campaigns ON campaigns.id = outbox.campaign_id "
+                "WHERE outbox.status = ? AND outbox.updated_date >= ? AND campaigns.from_email = ?",
+                (STATUS_SENT, since.strftime("%Y-%m-%d %H:%M:%S"), from_email)
+            ).fetchone()
+        return row[0]
+
+    def mark_sending(self, outbox_ids):
+        """Se llama justo antes de transmitir el mensaje."""
+        now = self._now()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_date = ? WHERE id = ?",
+                [(STATUS_SENDING, now, outbox_id) for outbox_id in outbox_ids]
+            )
+            self.conn.commit()
+
+    def mark_pending(self, outbox_ids):
+        """Devuelve a la cola filas que no llegaron a transmitirse."""
+        self._set_status(outbox_ids, STATUS_PENDING, None)
+
+    def mark_retry(self, outbox_ids, error):
+        """Error temporal: las filas quedan pendientes de reintento con su último error."""
+        self._set_status(outbox_ids, STATUS_PENDING, str(error))
+
+    def mark_sent(self, outbox_ids):
+        self._set_status(outbox_ids, STATUS_SENT, None)
+
+    def mark_failed(self, outbox_ids, error):
+        self._set_status(outbox_ids, STATUS_FAILED, str(error))
+
+    def mark_unknown(self, outbox_ids, error):
+        """Se perdió la respuesta tras transmitir el mensaje: no se reenvía."""
+        self._set_status(outbox_ids, STATUS_UNKNOWN, str(error))
+
+    def _set_status(self, outbox_ids, status, error):
+        now = self._now()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE outbox SET status = ?, last_error = ?, updated_date = ? WHERE id = ?",
+                [(status, error, now, outbox_id) for outbox_id in outbox_ids]
+            )
+            self.conn.commit()
@@ -0,0 +1,204 @@
+"""Precalentado de conexiones SMTP mientras se prepara la campaña.
+
+Un ``ConnectionPool`` abre y autentica en segundo plano las sesiones de una cuenta
+en cuanto se conocen sus datos, y las mantiene vivas con NOOP hasta que el motor de
+envío se las queda. Así el primer mensaje sale sin esperar a la conexión, STARTTLS
+y el login, y una contraseña incorrecta se detecta antes de pulsar "Enviar".
+"""
+import queue
+import smtplib
+import threading
+import time
+
+from email_engine import describe_error, make_ssl_context, open_session
+
+# Estados que publica el pool en sus eventos ("prewarm", estado, mensaje)
+POOL_CONNECTING = "connecting"
+POOL_READY = "ready"
+POOL_AUTH_ERROR = "auth_error"
+POOL_ERROR = "error"
+POOL_IDLE = "idle"
+
+
+def settings_key(settings):
+    """Lo que identifica una sesión SMTP: el remitente no influye en la conexión."""
+    return (settings.server, int(settings.port), settings.user, settings.password,
+            settings.implicit_tls)
+
+
+class ConnectionPool:
+    """Sesiones SMTP abiertas de antemano para una cuenta.
+
+    Un hilo abre hasta ``size`` sesiones una tras otra y envía NOOP a las que llevan
+    ``keepalive`` segundos sin usarse; las que no responden se sustituyen. Si el
+    servidor rechaza las credenciales el pool deja de intentarlo (para no bloquear
+    la cuenta); ante otros errores lo vuelve a intentar cada ``retry_delay``
+    segundos. Si en ``max_idle`` segundos nadie se queda con las sesiones, se
+    cierran para no ocupar el servidor.
+
+    Cada cambio de estado se publica en ``events`` como
+    ``("prewarm", estado, mensaje)``, con los estados ``POOL_*``. ``checkout``
+    entrega las sesiones abiertas y cierra el pool: a partir de ahí son del motor.
+    """
+
+    def __init__(self, settings, size=1, events=None, ssl_context=None, connect_timeout=30,
+                 command_timeout=60, data_timeout=300, keepalive=60, retry_delay=30,
+                 max_idle=900):
+        self.settings = settings
+        self.size = max(1, int(size))
+        self.events = events if events is not None else queue.Queue()
+        self.ssl_context = ssl_context or make_ssl_context()
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.data_timeout = data_timeout
+        self.keepalive = keepalive
+        self.retry_delay = retry_delay
+        self.max_idle = max_idle
+        # Última sesión TLS, para que el motor reanude en vez de repetir el handshake
+        self.tls_session = None
+        self.status = POOL_CONNECTING
+        # Sesiones listas: (sesión, instante del último uso)
+        self._sessions = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def emit(self, *event):
+        self.events.put(event)
+
+    def matches(self, settings):
+        """Indica si las sesiones del pool sirven para ``settings``."""
+        return settings_key(settings) == settings_key(self.settings)
+
+    @property
+    def ready(self):
+        with self._cond:
+            return len(self._sessions)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="smtp-prewarm", daemon=True)
+        self._thread.start()
+        return self
+
+    def resize(self, size):
+        """Cambia el número de sesiones que se mantienen abiertas."""
+        with self._cond:
+            self.size = max(1, int(size))
+            self._cond.notify_all()
+
+    def checkout(self):
+        """Entrega las sesiones abiertas y cierra el pool (no abre ni cierra ninguna más)."""
+        with self._cond:
+            sessions = [server for server, _ in self._sessions]
+            self._sessions = []
+            self._closed = True
+            self._cond.notify_all()
+        return sessions
+
+    def close(self):
+        """Cierra el pool y sus sesiones en segundo plano, sin esperar al servidor."""
+        sessions = self.checkout()
+        if sessions:
+            threading.Thread(target=self._quit_all, args=(sessions,), daemon=True).start()
+
+    # --- Hilo del pool ---
+
+    def _run(self):
+        self._set_status(POOL_CONNECTING, f"Conectando con {self.settings.server}...")
+        retry_at = 0.0
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                missing = self.size - len(self._sessions)
+                extra = self._sessions[self.size:]
+                del self._sessions[self.size:]
+            if extra:
+                self._quit_all([server for server, _ in extra])
+
+            now = time.monotonic()
+            if now - started >= self.max_idle:
+                with self._cond:
+                    idle = [server for server, _ in self._sessions]
+                    self._sessions = []
+                    self._closed = True
+                self._quit_all(idle)
+                self._set_status(POOL_IDLE, "Conexiones cerradas por inactividad.")
+                return
+            if missing > 0 and now >= retry_at:
+                if not self._open_one():
+                    if self.status == POOL_AUTH_ERROR:
+                        return
+                    retry_at = time.monotonic() + self.retry_delay
+                continue
+            self._keep_alive()
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(1.0)
+
+    def _open_one(self):
+        """Abre una sesión más; devuelve False si no se pudo."""
+        try:
+            server, _ = open_session(self.settings, self.ssl_context, self.tls_session,
+                                     self.connect_timeout, self.command_timeout,
+                                     self.data_timeout)
+        except smtplib.SMTPAuthenticationError as e:
+            with self._cond:
+                self._closed = True
+            self._set_status(POOL_AUTH_ERROR, "El servidor rechazó el usuario o la contraseña: "
+                                              f"{describe_error(e)}")
+            return False
+        except Exception as e:
+            self._set_status(POOL_ERROR, f"No se pudo conectar con {self.settings.server}: {e}")
+            return False
+        with self._cond:
+            if self._closed:
+                # Se entregó o cerró el pool mientras se abría esta sesión
+                closed = True
+            else:
+                closed = False
+                self.tls_session = server.sock.session
+                self._sessions.append((server, time.monotonic()))
+                count = len(self._sessions)
+        if closed:
+            self._quit_all([server])
+            return True
+        self._set_status(POOL_READY, f"Conexión lista ({count} de {self.size} abiertas).")
+        return True
+
+    def _keep_alive(self):
+        """NOOP a las sesiones que llevan ``keepalive`` segundos sin usarse."""
+        now = time.monotonic()
+        with self._cond:
+            due = [item for item in self._sessions if now - item[1] >= self.keepalive]
+            # Fuera de la lista mientras se comprueban: checkout no las entrega a medias
+            self._sessions = [item for item in self._sessions if item not in due]
+        for server, _ in due:
+            try:
+                code, _ = server.noop()
+                alive = code == 250
+            except Exception:
+                alive = False
+            if not alive:
+                server.close()
+                continue
+            with self._cond:
+                if self._closed:
+                    alive = False
+                else:
+                    self._sessions.append((server, time.monotonic()))
+            if not alive:
+                self._quit_all([server])
+
+    def _set_status(self, status, message):
+        self.status = status
+        self.emit("prewarm", status, message)
+
+    @staticmethod
+    def _quit_all(sessions):
+        for server in sessions:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
@@ -0,0 +1,126 @@
+"""Limitación de velocidad de envío (token bucket) con límites por proveedor SMTP."""
+import fnmatch
+import threading
+import time
+
+# Límites orientativos de los proveedores más habituales, por nombre del servidor SMTP.
+# Se expresan en mensajes por segundo, minuto y día; los que no aparecen no se limitan.
+PROVIDER_LIMITS = {
+    "smtp.gmail.com": {"per_second": 2, "per_minute": 60, "per_day": 500},
+    "smtp.googlemail.com": {"per_second": 2, "per_minute": 60, "per_day": 500},
+    "smtp-relay.gmail.com": {"per_second": 5, "per_minute": 300, "per_day": 10000},
+    "smtp.office365.com": {"per_second": 1, "per_minute": 30, "per_day": 10000},
+    "smtp-mail.outlook.com": {"per_second": 1, "per_minute": 30, "per_day": 300},
+    "smtp.mail.yahoo.com": {"per_second": 1, "per_minute": 20, "per_day": 500},
+    "smtp.zoho.com": {"per_second": 1, "per_minute": 30, "per_day": 500},
+    "smtp.zoho.eu": {"per_second": 1, "per_minute": 30, "per_day": 500},
+    "smtp.ionos.es": {"per_second": 1, "per_minute": 50, "per_day": 500},
+    "smtp.sendgrid.net": {"per_second": 50},
+    "smtp.mailgun.org": {"per_second": 50},
+    "email-smtp.*.amazonaws.com": {"per_second": 14, "per_day": 50000},
+}
+
+# Duración de cada ventana en segundos
+WINDOWS = {"per_second": 1, "per_minute": 60, "per_day": 86400}
+
+
+def limits_for_host(host):
+    """Devuelve los límites predefinidos para un servidor SMTP (o un diccionario vacío)."""
+    host = (host or "").strip().lower()
+    if host in PROVIDER_LIMITS:
+        return dict(PROVIDER_LIMITS[host])
+    for pattern, limits in PROVIDER_LIMITS.items():
+        if fnmatch.fnmatch(host, pattern):
+            return dict(limits)
+    return {}
+
+
+def describe_limits(limits):
+    """Texto legible de unos límites, p. ej. ``2/s, 60/min, 500/día``."""
+    units = {"per_second": "s", "per_minute": "min", "per_day": "día"}
+    parts = [f"{limits[key]:g}/{unit}" for key, unit in units.items() if limits.get(key)]
+    return ", ".join(parts) or "sin límite"
+
+
+class TokenBucket:
+    """Cubo de ``capacity`` fichas que se rellena a ``rate`` fichas por segundo."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now, amount=1):
+        """Segundos que faltan para disponer de ``amount`` fichas.
+
+        Si se piden más fichas que la capacidad basta con tener el cubo lleno: el
+        saldo queda negativo y las siguientes peticiones esperan a que se recupere.
+        """
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def consume(self, amount=1):
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Combina un token bucket por ventana (segundo, minuto y día).
+
+    ``acquire`` bloquea hasta que todas las ventanas tienen ficha y las consume a la
+    vez; es seguro usarlo desde varios hilos que comparten el mismo límite.
+    """
+
+    def __init__(self, per_second=None, per_minute=None, per_day=None):
+        self.limits = {"per_second": per_second, "per_minute": per_minute, "per_day": per_day}
+        self.buckets = {}
+        for key, limit in self.limits.items():
+            if limit:
+                self.buckets[key] = TokenBucket(limit / WINDOWS[key], limit)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_limits(cls, limits):
+        return cls(limits.get("per_second"), limits.get("per_minute"), limits.get("per_day"))
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    def preload(self, key, used):
+        """Descuenta envíos ya hechos en la ventana (p. ej. los de las últimas 24 horas)."""
+        bucket = self.buckets.get(key)
+        if bucket and used:
+            with self._lock:
+                bucket.consume(min(used, bucket.capacity))
+
+    def acquire(self, count=1, stop_event=None, on_wait=None):
+        """Espera a que haya ``count`` fichas en todas las ventanas y las consume.
+
+        ``on_wait(segundos)`` se llama una vez si la espera va a ser larga. Devuelve
+        False si ``stop_event`` se activa mientras se espera.
+        """
+        notified = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max((bucket.wait_time(now, count) for bucket in self.buckets.values()),
+                           default=0.0)
+                if wait <= 0:
+                    for bucket in self.buckets.values():
+                        bucket.consume(count)
+                    return True
+            if on_wait and wait > 5 and not notified:
+                notified = True
+                on_wait(wait)
+            if stop_event is not None:
+                if stop_event.wait(min(wait, 1.0)):
+                    return False
+            else:
+                time.sleep(min(wait, 1.0))
@@ -3,11 +3,105 @@ import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from tkinter import filedialog, messagebox
 from tkinter.scrolledtext import ScrolledText
-import csv
-import smtplib
+import logging
+import multiprocessing
 import os  # Añadir esta línea
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import queue
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from email_dryrun import DryRunEngine
+from email_engine import EmailSenderEngine, SmtpSettings, load_recipients_csv
+from email_message import TemplateError, recipient_variables
+from email_outbox import OutboxManager, campaign_key, get_application_path
+from email_pool import POOL_AUTH_ERROR, ConnectionPool
+
+# Resumen de métricas del último envío (tiempos por fase), junto a la aplicación
+METRICS_FILE = "envioemail_metrics.json"
+
+# Espera antes de abrir las conexiones tras terminar de editar los datos SMTP (ms)
+PREWARM_DELAY = 1500
+
+# Eventos del motor que se atienden como mucho en cada vuelta del bucle de Tk
+SEND_EVENTS_PER_TICK = 500
+
+
+class BufferedLogView:
+    """Log de envío: agrupa los mensajes y los vuelca al widget cada pocos milisegundos.
+
+    En pantalla solo se conservan las últimas ``max_lines`` líneas; el log completo
+    se escribe en un fichero rotativo junto a la aplicación, desde un hilo aparte
+    para que el bucle de Tk no espere al disco. ``close`` vuelca lo que quede.
+    """
+
+    def __init__(self, master, text_widget, max_lines=2000, flush_interval=200,
+                 log_file="envioemail.log"):
+        self.master = master
+        self.text = text_widget
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        # Las entradas que no caben en pantalla se descartan al llegar
+        self.pending = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+
+        self.text.tag_config("success", foreground="green")
+        self.text.tag_config("error", foreground="red")
+        self.text['state'] = "disabled"
+
+        self.file_logger = logging.getLogger("envioemail")
+        self.file_logger.setLevel(logging.INFO)
+        self._listener = None
+        if not self.file_logger.handlers:
+            try:
+                handler = RotatingFileHandler(
+                    os.path.join(get_application_path(), log_file),
+                    maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
+                )
+            except OSError as e:
+                # En la aplicación con ventana no hay consola: el aviso va al propio log
+                self.pending.append((f"No se pudo abrir el fichero de log: {e}", "error"))
+            else:
+                handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+                # write() solo encola el registro; el hilo del listener lo escribe
+                log_queue = queue.SimpleQueue()
+                self.file_logger.addHandler(QueueHandler(log_queue))
+                self._listener = QueueListener(log_queue, handler)
+                self._listener.start()
+
+        self.master.after(self.flush_interval, self._flush)
+
+    def write(self, message, tag=None):
+        """Encola un mensaje; se puede llamar desde cualquier hilo."""
+        with self._lock:
+            self.pending.append((message, tag))
+        self.file_logger.log(logging.ERROR if tag == "error" else logging.INFO, message)
+
+    def _flush(self):
+        """Vuelca al widget los mensajes acumulados en una sola inserción."""
+        with self._lock:
+            entries = list(self.pending)
+            self.pending.clear()
+
+        if entries:
+            # insert() admite varios pares texto/tag en una sola llamada
+            chunks = []
+            for message, tag in entries:
+                chunks.extend((message + "\n", tag or ()))
+            self.text['state'] = "normal"
+            self.text.insert(tk.END, *chunks)
+            lines = int(self.text.index("end-1c").split(".")[0]) - 1
+            if lines > self.max_lines:
+                self.text.delete("1.0", f"{lines - self.max_lines + 1}.0")
+            self.text.see(tk.END)
+            self.text['state'] = "disabled"
+
+        self.master.after(self.flush_interval, self._flush)
+
+    def close(self):
+        """Escribe en el fichero los mensajes pendientes y detiene su hilo."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
 
 class EmailSenderGUI:
     def __init__(self, master):
@@ -75,9 +169,39 @@ class EmailSenderGUI:
         self.smtp_password_var = tk.StringVar()
         self.from_email_var = tk.StringVar()
         self.subject_var = tk.StringVar()
+        self.connections_var = tk.StringVar(value="3")
+        self.recycle_var = tk.StringVar(value="100")
+        # Con el ajuste automático, las conexiones simultáneas son el máximo
+        self.adaptive_var = tk.BooleanVar(value=False)
         
         # Lista de destinatarios (se llenará al importar CSV o pegar emails)
         self.recipients = []  # Lista de diccionarios: {"email": ..., "nombre": ...}
+
+        # Ficheros adjuntos a todos los mensajes (se codifican una vez por campaña)
+        self.attachment_paths = []
+        self.attachments_var = tk.StringVar(value="Sin adjuntos")
+        # Adjunto propio de cada destinatario, p. ej. facturas/{client_code}.pdf
+        self.attachment_pattern_var = tk.StringVar()
+        # Las rutas relativas del adjunto personal se buscan junto al CSV importado
+        self.csv_dir = None
+
+        # Cola de eventos del hilo de envío hacia la interfaz (se drena con after())
+        self.send_events = queue.Queue()
+        self.send_thread = None
+        self.send_engine = None
+        # Progreso y ritmo en vivo del envío en curso
+        self.stats_var = tk.StringVar(value="")
+        self.send_progress = (0, 0, 0)
+        self.send_rate = (0.0, 0.0)
+        self.send_adaptive = None
+
+        # Conexiones SMTP abiertas de antemano mientras se prepara la campaña
+        self.pool = None
+        self.pool_status_var = tk.StringVar(value="")
+        self._prewarm_job = None
+
+        # Bandeja de salida persistente para poder reanudar envíos interrumpidos
+        self.outbox = OutboxManager()
         
         # --- Header con logo y título ---
         header = ttk.Frame(self.scrollable_frame)  # Quitamos el bootstyle="primary" para evitar el azul
@@ -125,18 +249,35 @@ class EmailSenderGUI:
         smtp_frame.grid(row=1, column=0, padx=10, pady=5, sticky="ew")
         smtp_frame.columnconfigure(1, weight=1)
         
-        labels = ["Servidor SMTP:", "Puerto:", "Usuario:", "Contraseña:", "Email remitente:"]
+        labels = ["Servidor SMTP:", "Puerto:", "Usuario:", "Contraseña:", "Email remitente:",
+                  "Conexiones simultáneas:", "Reciclar sesión cada (mensajes, 0 = nunca):"]
         vars = [self.smtp_server_var, self.smtp_port_var, self.smtp_user_var, 
-                self.smtp_password_var, self.from_email_var]
+                self.smtp_password_var, self.from_email_var, self.connections_var,
+                self.recycle_var]
         
+        # Datos de la cuenta: las conexiones se preparan al terminar de escribirlos
+        credentials = (self.smtp_server_var, self.smtp_port_var, self.smtp_user_var,
+                       self.smtp_password_var)
         for idx, (label, var) in enumerate(zip(labels, vars)):
             ttk.Label(smtp_frame, text=label).grid(row=idx, column=0, sticky="w", padx=5, pady=2)
             if label == "Contraseña:":
-                ttk.Entry(smtp_frame, textvariable=var, show="*").grid(
-                    row=idx, column=1, sticky="ew", padx=5, pady=2)
+                entry = ttk.Entry(smtp_frame, textvariable=var, show="*")
             else:
-                ttk.Entry(smtp_frame, textvariable=var).grid(
-                    row=idx, column=1, sticky="ew", padx=5, pady=2)
+                entry = ttk.Entry(smtp_frame, textvariable=var)
+            entry.grid(row=idx, column=1, sticky="ew", padx=5, pady=2)
+            if var in credentials:
+                # Al salir del campo o pulsar Intro, nunca a mitad de escribir la contraseña
+                entry.bind("<FocusOut>", self._schedule_prewarm)
+                entry.bind("<Return>", self._schedule_prewarm)
+        ttk.Checkbutton(
+            smtp_frame, text="Ajuste automático de conexiones y ritmo (las conexiones son el máximo)",
+            variable=self.adaptive_var
+        ).grid(row=len(labels), column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        ttk.Label(smtp_frame, textvariable=self.pool_status_var).grid(
+            row=len(labels) + 1, column=0, columnspan=2, sticky="w", padx=5, pady=2)
+        # Cambiar el número de conexiones solo ajusta el tamaño del pool
+        for var in (self.connections_var, self.adaptive_var):
+            var.trace_add("write", self._schedule_prewarm)
 
         # --- Asunto del Email ---
         subject_frame = ttk.Labelframe(self.scrollable_frame, text="Asunto del Email", padding=10)
@@ -166,14 +307,35 @@ class EmailSenderGUI:
         message_frame.grid(row=4, column=0, padx=10, pady=5, sticky="nsew")
         self.message_text = ScrolledText(message_frame, height=10)
         self.message_text.pack(fill="both", expand=True, padx=5, pady=2)
+        attachments_frame = ttk.Frame(message_frame)
+        attachments_frame.pack(fill="x", padx=5, pady=2)
+        ttk.Button(
+            attachments_frame,
+            text="Añadir adjunto",
+            command=self.add_attachments,
+            style="primary.TButton"
+        ).pack(side="left")
+        ttk.Button(
+            attachments_frame,
+            text="Quitar adjuntos",
+            command=self.clear_attachments
+        ).pack(side="left", padx=5)
+        ttk.Label(attachments_frame, textvariable=self.attachments_var).pack(side="left", padx=5)
+        pattern_frame = ttk.Frame(message_frame)
+        pattern_frame.pack(fill="x", padx=5, pady=2)
+        ttk.Label(pattern_frame, text="Adjunto por destinatario (p. ej. facturas/{client_code}.pdf):").pack(side="left")
+        ttk.Entry(pattern_frame, textvariable=self.attachment_pattern_var).pack(
+            side="left", fill="x", expand=True, padx=5)
 
         # --- Variables Disponibles (Tutorial) ---
         tutorial_frame = ttk.Labelframe(self.scrollable_frame, text="Variables Disponibles", padding=10)
         tutorial_frame.grid(row=5, column=0, padx=10, pady=5, sticky="ew")
         tutorial_msg = (
-            "Puedes usar las siguientes variables en el cuerpo del email:\n"
+            "Puedes usar las siguientes variables en el asunto y el cuerpo del email:\n"
             "  {email}  - Dirección de correo del destinatario\n"
-            "  {nombre} - Nombre del destinatario (si está en el CSV; de lo contrario se usará el email)"
+            "  {nombre} - Nombre del destinatario (si está en el CSV; de lo contrario se usará el email)\n"
+            "  Cualquier otra columna del CSV, en minúsculas y con _ en lugar de espacios "
+            "(p. ej. {client_code})"
         )
         ttk.Label(tutorial_frame, text=tutorial_msg).pack(anchor="w")
 
@@ -182,15 +344,37 @@ class EmailSenderGUI:
         log_frame.grid(row=6, column=0, padx=10, pady=5, sticky="nsew")
         self.log_text = ScrolledText(log_frame, height=10)
         self.log_text.pack(fill="both", expand=True, padx=5, pady=2)
+        self.log_view = BufferedLogView(master, self.log_text)
+        ttk.Label(log_frame, textvariable=self.stats_var).pack(anchor="w", padx=5, pady=(2, 0))
 
-        # --- Botón Enviar ---
-        ttk.Button(
-            self.scrollable_frame,
+        # --- Botones Enviar y Simular ---
+        buttons_frame = ttk.Frame(self.scrollable_frame)
+        buttons_frame.grid(row=7, column=0, pady=10)
+        self.send_button = ttk.Button(
+            buttons_frame,
             text="Enviar Emails",
             command=self.send_emails,
             style="success.TButton",
             width=20
-        ).grid(row=7, column=0, pady=10)
+        )
+        self.send_button.pack(side="left", padx=5)
+        # Genera todos los mensajes en un buzón local sin conectar con ningún servidor
+        self.dry_run_button = ttk.Button(
+            buttons_frame,
+            text="Simular envío",
+            command=self.simulate_emails,
+            width=20
+        )
+        self.dry_run_button.pack(side="left", padx=5)
+        # Mensaje que se cuela delante de la campaña en curso (solo durante un envío)
+        self.urgent_button = ttk.Button(
+            buttons_frame,
+            text="Envío urgente",
+            command=self.urgent_email,
+            state="disabled",
+            width=20
+        )
+        self.urgent_button.pack(side="left", padx=5)
 
         # --- Footer ---
         footer = ttk.Frame(self.scrollable_frame)
@@ -204,6 +388,34 @@ class EmailSenderGUI:
         # Configuración de peso para que se redimensione bien la ventana
         self.scrollable_frame.grid_rowconfigure(4, weight=1)
         self.scrollable_frame.grid_columnconfigure(0, weight=1)
+
+        self._restore_unfinished_campaign()
+        self.master.after(250, self._process_pool_events)
+
+    def _restore_unfinished_campaign(self):
+        """Si quedó una campaña a medias, recupera su mensaje, sus adjuntos y sus destinatarios."""
+        campaign = self.outbox.find_unfinished_campaign()
+        if not campaign:
+            return
+        # Los ya enviados están en la bandeja de salida: basta con los pendientes
+        pending = [recipient for _, recipient in self.outbox.pending(campaign["id"])]
+        self.from_email_var.set(campaign["from_email"])
+        self.subject_var.set(campaign["subject"])
+        self.message_text.delete("1.0", tk.END)
+        self.message_text.insert("1.0", campaign["body_template"])
+        attachments = campaign["attachments"]
+        if attachments:
+            self.attachment_paths = attachments["attachments"]
+            self._update_attachments()
+            self.attachment_pattern_var.set(" ".join(attachments["attachment_patterns"]))
+            self.csv_dir = attachments["attachments_dir"]
+        self.recipients = pending
+        self.recipients_text.delete("1.0", tk.END)
+        self.recipients_text.insert(tk.END, ", ".join([r["email"] for r in pending]))
+        self.log(
+            f"Se encontró un envío interrumpido con {len(pending)} correos pendientes. "
+            "Completa la configuración SMTP y pulsa 'Enviar Emails' para reanudarlo."
+        )
     
     def _bound_to_mousewheel(self, event):
         self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
@@ -224,30 +436,14 @@ class EmailSenderGUI:
             if not file_path:
                 return
             
-            self.recipients = []
-            with open(file_path, 'r', encoding='utf-8') as f:
-                # Usar siempre coma
-                reader = csv.DictReader(f, delimiter=',')
-
-                # Normalizar las columnas a minúsculas
-                fieldnames_lower = [col.lower() for col in reader.fieldnames]
-                if 'nombre' not in fieldnames_lower or 'email' not in fieldnames_lower:
-                    messagebox.showerror(
-                        "Error",
-                        "El CSV debe contener columnas 'nombre' y 'email'."
-                    )
-                    return
-                
-                valid_count = 0
-                for row in reader:
-                    # Acceder usando las columnas normalizadas
-                    nombre = row.get('nombre') or row.get('Nombre') or ''
-                    email = row.get('email') or row.get('Email') or ''
-                    nombre = nombre.strip()
-                    email = email.strip()
-                    if '@' in email:
-                        self.recipients.append({"nombre": nombre or email, "email": email})
-                        valid_count += 1
+            try:
+                self.recipients = load_recipients_csv(file_path)
+                self.csv_dir = os.path.dirname(file_path)
+            except ValueError as e:
+                self.recipients = []
+                messagebox.showerror("Error", str(e))
+                return
+            valid_count = len(self.recipients)
             
             if self.recipients:
                 self.recipients_text.delete("1.0", tk.END)
@@ -264,16 +460,48 @@ class EmailSenderGUI:
             )
             self.log(f"Error en import_csv: {e}", "error")
     
+    def add_attachments(self):
+        """Añade ficheros que se adjuntarán a todos los mensajes de la campaña."""
+        paths = filedialog.askopenfilenames(title="Seleccionar adjuntos")
+        for path in paths:
+            if path not in self.attachment_paths:
+                self.attachment_paths.append(path)
+        self._update_attachments()
+
+    def clear_attachments(self):
+        self.attachment_paths = []
+        self._update_attachments()
+
+    def _update_attachments(self):
+        names = [os.path.basename(path) for path in self.attachment_paths]
+        self.attachments_var.set("Adjuntos: " + ", ".join(names) if names else "Sin adjuntos")
+
+    def _attachment_options(self, recipients_list):
+        """Argumentos de adjuntos y variables para los motores de envío y simulación."""
+        pattern = self.attachment_pattern_var.get().strip()
+        return {
+            "attachments": self.attachment_paths,
+            "attachment_patterns": [pattern] if pattern else [],
+            "attachments_dir": self.csv_dir,
+            "variables": recipient_variables(recipients_list),
+        }
+
+    def _confirm_missing_attachments(self, engine, recipients_list):
+        """Comprueba los adjuntos personales antes de empezar; False si se cancela."""
+        missing = engine.preflight(recipients_list)
+        if not missing:
+            return True
+        listed = "\n".join(f"{recipient['email']}: {path}" for recipient, path in missing[:10])
+        more = f"\n... y {len(missing) - 10} más" if len(missing) > 10 else ""
+        return messagebox.askyesno(
+            "Faltan adjuntos",
+            f"No se encontraron {len(missing)} adjuntos personales:\n{listed}{more}\n\n"
+            "¿Deseas continuar? Esos destinatarios se darán por fallidos."
+        )
+
     def log(self, message, tag=None):
         """Agrega un mensaje al área de log con color verde o rojo."""
-        self.log_text['state'] = "normal"
-        self.log_text.insert(tk.END, message + "\n", tag)
-        if tag == "success":
-            self.log_text.tag_config("success", foreground="green")
-        elif tag == "error":
-            self.log_text.tag_config("error", foreground="red")
-        self.log_text.see(tk.END)
-        self.log_text['state'] = "disabled"
+        self.log_view.write(message, tag)
     
     def send_emails(self):
         """Envía correos a los destinatarios."""
@@ -304,14 +532,163 @@ class EmailSenderGUI:
         from_email = self.from_email_var.get().strip()
         subject = self.subject_var.get().strip()
         message_body_template = self.message_text.get("1.0", tk.END).strip()
+        try:
+            connections = int(self.connections_var.get().strip())
+            if connections < 1:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "El número de conexiones debe ser un entero mayor que 0.")
+            return
+        try:
+            recycle_after = int(self.recycle_var.get().strip() or 0)
+            if recycle_after < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "El reciclado de sesión debe ser un entero mayor o igual que 0.")
+            return
         
         # Validar que se hayan completado todos los campos
         if not smtp_server or not smtp_port or not smtp_user or not smtp_password or not from_email or not subject or not message_body_template:
             messagebox.showerror("Error", "Por favor, complete todos los campos de configuración y mensaje.")
             return
         
-        # Obtener destinatarios:
+        recipients_list = self._collect_recipients()
+        if not recipients_list:
+            messagebox.showerror("Error", "No se encontraron destinatarios.")
+            return
+        
+        if self.send_thread and self.send_thread.is_alive():
+            messagebox.showwarning("Aviso", "Ya hay un envío en curso.")
+            return
+
+        # Las plantillas se validan aquí, antes de abrir ninguna conexión SMTP
+        try:
+            engine = EmailSenderEngine(
+                SmtpSettings(smtp_server, smtp_port, smtp_user, smtp_password, from_email),
+                subject,
+                message_body_template,
+                connections=connections,
+                events=self.send_events,
+                outbox=self.outbox,
+                recycle_after=recycle_after,
+                metrics_path=os.path.join(get_application_path(), METRICS_FILE),
+                adaptive=self.adaptive_var.get(),
+                pool=self.pool,
+                **self._attachment_options(recipients_list)
+            )
+        except TemplateError as e:
+            messagebox.showerror("Error en la plantilla", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error en los adjuntos", f"No se pudo leer el adjunto:\n{e}")
+            return
+        if not self._confirm_missing_attachments(engine, recipients_list):
+            return
+
+        # Si esta misma campaña quedó a medias, se ofrece reanudarla sin repetir envíos
+        unfinished = self.outbox.find_unfinished_campaign(
+            campaign_key(from_email, subject, message_body_template,
+                         engine.attachment_settings))
+        if unfinished:
+            if messagebox.askyesno(
+                "Envío interrumpido",
+                "Esta campaña no terminó de enviarse. ¿Deseas reanudarla?\n"
+                "Los destinatarios que ya recibieron el correo no se volverán a enviar."
+            ):
+                engine.campaign_id = unfinished["id"]
+            else:
+                self.outbox.cancel_campaign(unfinished["id"])
+
+        self.log(f"Iniciando envío a {len(recipients_list)} destinatarios...")
+        # Las conexiones precalentadas pasan al motor, que cierra el pool
+        self.pool = None
+        self.pool_status_var.set("")
+        self._start_run(engine, recipients_list)
+
+    def urgent_email(self):
+        """Ventana para enviar un mensaje aparte por delante de la campaña en curso."""
+        window = ttk.Toplevel(self.master)
+        window.title("Envío urgente")
+        window.columnconfigure(1, weight=1)
+        to_var = tk.StringVar()
+        subject_var = tk.StringVar()
+        ttk.Label(window, text="Para (separados por comas):").grid(
+            row=0, column=0, sticky="w", padx=5, pady=2)
+        ttk.Entry(window, textvariable=to_var, width=50).grid(
+            row=0, column=1, sticky="ew", padx=5, pady=2)
+        ttk.Label(window, text="Asunto:").grid(row=1, column=0, sticky="w", padx=5, pady=2)
+        ttk.Entry(window, textvariable=subject_var).grid(
+            row=1, column=1, sticky="ew", padx=5, pady=2)
+        body_text = ScrolledText(window, height=8, width=60)
+        body_text.grid(row=2, column=0, columnspan=2, sticky="nsew", padx=5, pady=2)
+
+        def submit():
+            recipients = [{"email": email.strip(), "nombre": email.strip()}
+                          for email in to_var.get().split(",") if email.strip()]
+            subject = subject_var.get().strip()
+            body = body_text.get("1.0", tk.END).strip()
+            if not recipients or not subject or not body:
+                messagebox.showerror("Error", "Indica los destinatarios, el asunto y el mensaje.",
+                                     parent=window)
+                return
+            if self.send_engine is None:
+                messagebox.showerror("Error", "El envío ya ha terminado.", parent=window)
+                return
+            try:
+                queued = self.send_engine.submit(recipients, subject, body)
+            except TemplateError as e:
+                messagebox.showerror("Error en la plantilla", str(e), parent=window)
+                return
+            if not queued:
+                messagebox.showerror("Error", "El envío ya ha terminado.", parent=window)
+                return
+            window.destroy()
+
+        ttk.Button(window, text="Enviar ahora", command=submit, style="success.TButton").grid(
+            row=3, column=0, columnspan=2, pady=5)
+
+    def simulate_emails(self):
+        """Genera la campaña completa en un buzón mbox local, sin enviar nada."""
+        from_email = self.from_email_var.get().strip()
+        subject = self.subject_var.get().strip()
+        message_body_template = self.message_text.get("1.0", tk.END).strip()
+        if not from_email or not subject or not message_body_template:
+            messagebox.showerror("Error", "Por favor, complete el remitente, el asunto y el cuerpo.")
+            return
+        recipients_list = self._collect_recipients()
+        if not recipients_list:
+            messagebox.showerror("Error", "No se encontraron destinatarios.")
+            return
+        if self.send_thread and self.send_thread.is_alive():
+            messagebox.showwarning("Aviso", "Ya hay un envío en curso.")
+            return
+
+        path = filedialog.asksaveasfilename(
+            title="Guardar simulación como buzón mbox",
+            defaultextension=".mbox",
+            filetypes=[("Buzón mbox", "*.mbox")]
+        )
+        if not path:
+            return
+        try:
+            engine = DryRunEngine(from_email, subject, message_body_template, path,
+                                  events=self.send_events,
+                                  **self._attachment_options(recipients_list))
+        except TemplateError as e:
+            messagebox.showerror("Error en la plantilla", str(e))
+            return
+        except OSError as e:
+            messagebox.showerror("Error en los adjuntos", f"No se pudo leer el adjunto:\n{e}")
+            return
+        if not self._confirm_missing_attachments(engine, recipients_list):
+            return
+        self._start_run(engine, recipients_list)
+
+    def _collect_recipients(self):
+        """Destinatarios del CSV importado o, si no hay, los emails escritos a mano."""
         # Si ya se importó un CSV, se usa esa lista; de lo contrario, se parsea el texto ingresado (emails separados por comas)
+        if self.recipients:
+            return self.recipients
         recipients_input = self.recipients_text.get("1.0", tk.END).strip()
         recipients_manual = []
         if recipients_input:
@@ -320,49 +697,155 @@ class EmailSenderGUI:
                 if email:
                     # En ausencia de nombre, se usará el email
                     recipients_manual.append({"email": email, "nombre": email})
-        
-        if self.recipients:
-            recipients_list = self.recipients
+        return recipients_manual
+
+    def _start_run(self, engine, recipients_list):
+        """Lanza ``engine.run`` en un hilo aparte para que la ventana siga respondiendo."""
+        self.send_button.configure(state="disabled")
+        self.dry_run_button.configure(state="disabled")
+        self.send_engine = engine
+        # Los envíos reales admiten mensajes urgentes; la simulación no
+        if isinstance(engine, EmailSenderEngine):
+            self.urgent_button.configure(state="normal")
+        self.send_progress = (0, 0, len(recipients_list))
+        self.send_rate = (0.0, 0.0)
+        self.send_adaptive = None
+        self._update_stats()
+        self.send_thread = threading.Thread(
+            target=engine.run,
+            args=(list(recipients_list),),
+            daemon=True
+        )
+        self.send_thread.start()
+        self.master.after(100, self._process_send_events)
+
+    def _process_send_events(self):
+        """Drena la cola de eventos del hilo de envío desde el bucle de Tk.
+
+        Atiende como mucho ``SEND_EVENTS_PER_TICK`` eventos por vuelta para que una
+        ráfaga no bloquee la ventana; si quedan más, vuelve enseguida.
+        """
+        finished = False
+        prewarm = False
+        stats_changed = False
+        try:
+            for _ in range(SEND_EVENTS_PER_TICK):
+                event = self.send_events.get_nowait()
+                kind = event[0]
+                if kind == "log":
+                    # El nivel es opcional: ("log", mensaje) es un mensaje informativo
+                    self.log(*event[1:])
+                elif kind == "progress":
+                    self.send_progress = event[1:4]
+                    stats_changed = True
+                elif kind == "rate":
+                    self.send_rate = event[1:3]
+                    stats_changed = True
+                elif kind == "adaptive":
+                    self.send_adaptive = event[1]
+                    stats_changed = True
+                elif kind == "fatal":
+                    self.log(event[1], "error")
+                    messagebox.showerror("Error", event[1])
+                elif kind == "done" and "written" in event[1]:
+                    # Fin de una simulación (DryRunEngine)
+                    finished = True
+                    messagebox.showinfo(
+                        "Simulación",
+                        "Se generaron {} mensajes en:\n{}".format(event[1]["written"], event[1]["path"])
+                    )
+                elif kind == "done":
+                    finished = True
+                    summary = event[1]
+                    # Tras una simulación o un envío fallido no se vuelve a iniciar sesión
+                    # sin que el usuario lo pida: con credenciales malas bloquearía la cuenta
+                    prewarm = summary["sent"] > 0 and not summary["auth_failed"]
+                    self.log(
+                        "Proceso completado. Correos enviados exitosamente: {} | Fallidos: {} | Pendientes: {}".format(
+                            summary["sent"], summary["failed"], summary["pending"]),
+                        "success" if not summary["failed"] else "error"
+                    )
+                    if summary["uncertain"]:
+                        self.log(f"{summary['uncertain']} correos con resultado desconocido (se cortó la "
+                                 "conexión tras enviarlos); no se han reenviado.", "error")
+                    if summary["metrics_path"]:
+                        self.log(f"Métricas del envío guardadas en {summary['metrics_path']}")
+                    messagebox.showinfo("Información", "Proceso completado. Correos enviados: {}".format(summary["sent"]))
+        except queue.Empty:
+            pass
+        if stats_changed:
+            # Una sola actualización de las estadísticas por vuelta
+            self._update_stats()
+
+        if finished:
+            self.send_button.configure(state="normal")
+            self.dry_run_button.configure(state="normal")
+            self.urgent_button.configure(state="disabled")
+            self.send_engine = None
+            if prewarm:
+                self._schedule_prewarm()
         else:
-            recipients_list = recipients_manual
-        
-        if not recipients_list:
-            messagebox.showerror("Error", "No se encontraron destinatarios.")
+            backlog = not self.send_events.empty()
+            self.master.after(10 if backlog else 100, self._process_send_events)
+
+    def _schedule_prewarm(self, *args):
+        """Abre las conexiones cuando los datos SMTP dejan de cambiar durante un momento."""
+        if self._prewarm_job is not None:
+            self.master.after_cancel(self._prewarm_job)
+        self._prewarm_job = self.master.after(PREWARM_DELAY, self._prewarm)
+
+    def _prewarm(self):
+        """Crea el pool de conexiones para los datos SMTP actuales, si están completos."""
+        self._prewarm_job = None
+        if self.send_thread and self.send_thread.is_alive():
             return
-        
-        # Conectar al servidor SMTP
+        server = self.smtp_server_var.get().strip()
+        user = self.smtp_user_var.get().strip()
+        password = self.smtp_password_var.get().strip()
         try:
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al conectar con el servidor SMTP: {e}")
+            port = int(self.smtp_port_var.get().strip())
+            connections = int(self.connections_var.get().strip())
+        except ValueError:
+            port = connections = 0
+        if not (server and user and password and port > 0 and connections > 0):
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+            self.pool_status_var.set("")
             return
-        
-        success_count = 0
-        # Enviar correo a cada destinatario
-        for recipient in recipients_list:
+        # Con el ajuste automático el envío empieza con una sola conexión
+        size = 1 if self.adaptive_var.get() else connections
+        settings = SmtpSettings(server, port, user, password, self.from_email_var.get().strip())
+        if self.pool is not None and self.pool.matches(settings):
+            self.pool.resize(size)
+            return
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = ConnectionPool(settings, size, events=queue.Queue()).start()
+
+    def _process_pool_events(self):
+        """Muestra el estado de las conexiones precalentadas bajo los datos SMTP."""
+        if self.pool is not None:
             try:
-                # Se reemplazan las variables {email} y {nombre} en el cuerpo del mensaje
-                personalized_body = message_body_template.format(
-                    email=recipient["email"],
-                    nombre=recipient.get("nombre", recipient["email"])
-                )
-                msg = MIMEMultipart()
-                msg["From"] = from_email
-                msg["To"] = recipient["email"]
-                msg["Subject"] = subject
-                msg.attach(MIMEText(personalized_body, "plain"))
-                
-                server.send_message(msg)
-                success_count += 1
-                self.log(f"Correo enviado a: {recipient['email']}", "success")
-            except Exception as e:
-                self.log(f"Error al enviar a {recipient['email']}: {e}", "error")
-        
-        server.quit()
-        self.log("Proceso completado. Correos enviados exitosamente: {}".format(success_count), "success")
-        messagebox.showinfo("Información", "Proceso completado. Correos enviados: {}".format(success_count))
+                while True:
+                    _, status, message = self.pool.events.get_nowait()
+                    self.pool_status_var.set(message)
+                    if status == POOL_AUTH_ERROR:
+                        self.log(message, "error")
+            except queue.Empty:
+                pass
+        self.master.after(250, self._process_pool_events)
+
+    def _update_stats(self):
+        sent, failed, total = self.send_progress
+        per_second, error_rate = self.send_rate
+        stats = (f"Enviados {sent} de {total} · fallidos {failed} · "
+                 f"{per_second:.1f} msg/s · errores {error_rate:.1%}")
+        if self.send_adaptive is not None:
+            state = self.send_adaptive
+            stats += (f" · conexiones {state['connections']}/{state['max_connections']}"
+                      f" · límite {state['rate']:g} msg/s")
+        self.stats_var.set(stats)
 
     def _on_canvas_configure(self, event):
         """Ajusta el ancho del frame scrollable cuando se redimensiona la ventana"""
@@ -370,6 +853,9 @@ class EmailSenderGUI:
         self.canvas.itemconfig(self.canvas_window, width=event.width)
 
 if __name__ == "__main__":
+    # Necesario para la simulación en paralelo en el ejecutable de Windows
+    multiprocessing.freeze_support()
     root = ttk.Window(themename="cosmo")
     app = EmailSenderGUI(root)
     root.mainloop()
+    app.log_view.close()
@@ -0,0 +1,350 @@
+"""Envío de campañas sin interfaz gráfica (cron, servidores sin pantalla).
+
+Usa el mismo motor que envioemail.py pero no importa tkinter ni ttkbootstrap.
+Cada evento se escribe en la salida estándar como una línea JSON, por ejemplo::
+
+    {"event": "progress", "sent": 10, "failed": 0, "total": 250}
+
+Ejemplo::
+
+    ENVIOEMAIL_SMTP_PASSWORD=secreto python envioemail_cli.py \\
+        --server smtp.ejemplo.com --user yo@ejemplo.com --from yo@ejemplo.com \\
+        --subject "Novedades" --template cuerpo.txt --recipients clientes.csv
+
+Con ``--dry-run buzon.mbox`` no se conecta a ningún servidor: los mensajes se
+generan igual que en el envío real y se guardan en un mbox o Maildir local.
+
+Con ``--accounts cuentas.json`` la campaña se reparte entre varias cuentas SMTP,
+con un proceso por cuenta; ``--report`` guarda el resultado de cada destinatario.
+
+Códigos de salida: 0 todo enviado, 1 hubo fallos o quedaron pendientes,
+2 error en los parámetros, el CSV o la plantilla, 3 no se pudo conectar.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+from email_accounts import MultiAccountEngine, load_accounts
+from email_dryrun import MAILBOX_FORMATS, DryRunEngine
+from email_engine import EmailSenderEngine, SmtpSettings, load_recipients_csv, write_report
+from email_message import TemplateError, recipient_variables
+from email_outbox import OutboxManager, campaign_key
+
+EXIT_OK = 0
+EXIT_INCOMPLETE = 1
+EXIT_USAGE = 2
+EXIT_CONNECTION = 3
+
+PASSWORD_ENV = "ENVIOEMAIL_SMTP_PASSWORD"
+
+# Valor de SmtpSettings.implicit_tls para cada opción de --tls
+TLS_MODES = {"auto": None, "starttls": False, "implicit": True}
+
+
+class JsonLinesEvents:
+    """Sustituye a la cola de eventos del motor escribiendo cada evento como JSON."""
+
+    def __init__(self, stream=None, quiet=False):
+        self.stream = stream or sys.stdout
+        self.quiet = quiet
+        self.fatal = False
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        kind = event[0]
+        if kind == "log":
+            if self.quiet and event[2:3] != ("error",):
+                return
+            # El nivel es opcional: ("log", mensaje) equivale a un mensaje informativo
+            level = event[2] if len(event) > 2 else None
+            record = {"event": "log", "message": event[1], "level": level or "info"}
+        elif kind == "sent":
+            # El progreso ya se informa con el evento "progress"
+            return
+        elif kind == "progress":
+            record = {"event": "progress", "sent": event[1], "failed": event[2], "total": event[3]}
+        elif kind == "rate":
+            record = {"event": "rate", "msgs_per_second": round(event[1], 2),
+                      "error_rate": round(event[2], 4)}
+        elif kind == "adaptive":
+            record = {"event": "adaptive", "reason": event[2], **event[1]}
+        elif kind == "fatal":
+            self.fatal = True
+            record = {"event": "fatal", "message": event[1]}
+        elif kind == "done":
+            record = {"event": "done", **event[1]}
+        else:
+            record = {"event": kind, "data": list(event[1:])}
+        self.write(record)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Envío masivo de emails personalizados sin interfaz gráfica."
+    )
+    smtp = parser.add_argument_group("configuración SMTP")
+    smtp.add_argument("--server", help="servidor SMTP (no hace falta con --dry-run)")
+    smtp.add_argument("--port", type=int, default=587, help="puerto SMTP (por defecto 587)")
+    smtp.add_argument("--tls", choices=("auto", "starttls", "implicit"), default="auto",
+                      help="STARTTLS o TLS implícito; 'auto' usa TLS implícito en el puerto 465")
+    smtp.add_argument("--user", help="usuario SMTP (no hace falta con --dry-run)")
+    smtp.add_argument("--password",
+                      help=f"contraseña SMTP (mejor en la variable de entorno {PASSWORD_ENV})")
+    smtp.add_argument("--from", dest="from_email",
+                      help="email del remitente (con --accounts, el de cada cuenta)")
+    smtp.add_argument("--accounts", metavar="FICHERO",
+                      help="JSON con varias cuentas (server, port, user, password_env, from, "
+                           "per_day, connections...) entre las que repartir la campaña, "
+                           "una por proceso; sustituye a --server y --user")
+
+    message = parser.add_argument_group("mensaje")
+    message.add_argument("--subject", required=True, help="asunto (admite {email}, {nombre} y las columnas del CSV)")
+    message.add_argument("--template", required=True, help="fichero UTF-8 con el cuerpo del email")
+    message.add_argument("--recipients",
+                         help="CSV con columnas 'nombre' y 'email' (las demás columnas se "
+                              "pueden usar como variables)")
+    message.add_argument("--to", help="emails separados por comas (si no se usa --recipients)")
+    message.add_argument("--attach", metavar="FICHERO", action="append", default=[],
+                         help="adjuntar un fichero a todos los mensajes (se puede repetir)")
+    message.add_argument("--attach-pattern", metavar="PATRON", action="append", default=[],
+                         help="adjunto propio de cada destinatario, con columnas del CSV como "
+                              "variables, p. ej. 'facturas/{client_code}.pdf' (se puede repetir)")
+    message.add_argument("--attachments-dir", metavar="DIR",
+                         help="directorio base de las rutas relativas de --attach-pattern "
+                              "(por defecto, el del CSV)")
+    message.add_argument("--skip-missing-attachments", action="store_true",
+                         help="enviar aunque falten adjuntos personales (esos destinatarios "
+                              "se dan por fallidos)")
+
+    sending = parser.add_argument_group("envío")
+    sending.add_argument("--connections", type=int, default=3,
+                         help="conexiones simultáneas (con --adaptive, el máximo)")
+    sending.add_argument("--adaptive", action="store_true",
+                         help="ajustar solo las conexiones y el ritmo: empezar con una e ir "
+                              "subiendo mientras el servidor acepte, y bajar a la mitad ante "
+                              "respuestas 421/451/452 o si la latencia se dispara")
+    sending.add_argument("--recycle-after", type=int, default=100,
+                         help="reciclar cada sesión tras N mensajes (0 = nunca)")
+    sending.add_argument("--max-attempts", type=int, default=5,
+                         help="intentos por destinatario ante errores temporales")
+    sending.add_argument("--batch-size", type=int, default=50,
+                         help="destinatarios por transacción si el mensaje no lleva "
+                              "variables (1 = un mensaje por destinatario)")
+    sending.add_argument("--domain-connections", type=int,
+                         help="máximo de envíos simultáneos a un mismo dominio de destino")
+    sending.add_argument("--domain-rate", type=float,
+                         help="máximo de mensajes por minuto a un mismo dominio de destino")
+    sending.add_argument("--connect-timeout", type=float, default=30,
+                         help="segundos para conectar con el servidor")
+    sending.add_argument("--command-timeout", type=float, default=60,
+                         help="segundos de espera por la respuesta a cada comando SMTP")
+    sending.add_argument("--data-timeout", type=float, default=300,
+                         help="segundos para transmitir un mensaje y recibir su respuesta")
+    sending.add_argument("--stall-timeout", type=float, default=600,
+                         help="cortar la conexión si una transacción dura más de N segundos "
+                              "(0 = no vigilar)")
+    sending.add_argument("--per-second", type=float, help="límite de mensajes por segundo")
+    sending.add_argument("--per-minute", type=float, help="límite de mensajes por minuto")
+    sending.add_argument("--per-day", type=float, help="límite de mensajes por día")
+    sending.add_argument("--outbox",
+                         help="base de datos SQLite de la bandeja de salida; si la campaña "
+                              "quedó a medias se reanuda sin repetir envíos")
+    sending.add_argument("--report", metavar="FICHERO",
+                         help="guardar al terminar un CSV con el resultado de cada destinatario")
+    sending.add_argument("--metrics",
+                         help="guardar al terminar un resumen JSON con los tiempos de cada fase")
+    sending.add_argument("--dry-run", metavar="BUZON",
+                         help="no enviar: guardar los mensajes en este mbox o Maildir")
+    sending.add_argument("--dry-run-format", choices=MAILBOX_FORMATS, default="mbox",
+                         help="formato del buzón de --dry-run (por defecto mbox)")
+    sending.add_argument("--processes", type=int,
+                         help="procesos para generar los mensajes con --dry-run "
+                              "(por defecto, uno por núcleo)")
+    sending.add_argument("--quiet", action="store_true",
+                         help="no escribir una línea por cada correo enviado")
+    return parser
+
+
+def rate_limits_from_args(args):
+    """Límites indicados en la línea de comandos, o None para usar los del proveedor."""
+    limits = {
+        "per_second": args.per_second,
+        "per_minute": args.per_minute,
+        "per_day": args.per_day,
+    }
+    if not any(limits.values()):
+        return None
+    return {key: value for key, value in limits.items() if value}
+
+
+def read_recipients(args):
+    if args.recipients:
+        return load_recipients_csv(args.recipients)
+    recipients = []
+    for email in (args.to or "").split(","):
+        email = email.strip()
+        if email:
+            recipients.append({"email": email, "nombre": email})
+    return recipients
+
+
+def check_attachments(engine, recipients, args, events):
+    """Comprobación previa de los adjuntos personales; False si hay que abortar."""
+    missing = engine.preflight(recipients)
+    if not missing or args.skip_missing_attachments:
+        # El motor vuelve a comprobarlos y da por fallidos esos destinatarios
+        return True
+    for recipient, path in missing:
+        events.put(("log", f"Falta el adjunto de {recipient['email']}: {path}", "error"))
+    events.write({"event": "fatal",
+                  "message": f"Faltan {len(missing)} adjuntos personales; no se envía nada "
+                             "(usa --skip-missing-attachments para enviar al resto)."})
+    return False
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    events = JsonLinesEvents(quiet=args.quiet)
+
+    def usage_error(message):
+        events.write({"event": "fatal", "message": message})
+        return EXIT_USAGE
+
+    password = args.password or os.environ.get(PASSWORD_ENV, "")
+    accounts = None
+    if args.accounts and not args.dry_run:
+        if args.outbox:
+            return usage_error("--outbox no se puede usar con --accounts.")
+        if args.metrics:
+            return usage_error("--metrics no se puede usar con --accounts.")
+        try:
+            accounts = load_accounts(args.accounts)
+        except (OSError, ValueError) as e:
+            return usage_error(str(e))
+        # Los límites de la línea de comandos valen para las cuentas que no indican los suyos
+        default_limits = rate_limits_from_args(args)
+        for account in accounts:
+            if account.rate_limits is None and default_limits:
+                account.rate_limits = dict(default_limits)
+    elif not args.dry_run:
+        if not args.server or not args.user:
+            return usage_error("Faltan --server y --user (o usa --accounts o --dry-run).")
+        if not password:
+            return usage_error(f"Falta la contraseña SMTP (--password o {PASSWORD_ENV}).")
+    if not args.from_email and accounts is None:
+        return usage_error("Falta el remitente (--from).")
+    if args.connections < 1:
+        return usage_error("El número de conexiones debe ser un entero mayor que 0.")
+    if args.batch_size < 1:
+        return usage_error("El tamaño de lote debe ser un entero mayor que 0.")
+    try:
+        with open(args.template, "r", encoding="utf-8") as f:
+            body_template = f.read().strip()
+        recipients = read_recipients(args)
+    except (OSError, ValueError) as e:
+        return usage_error(str(e))
+    if not body_template:
+        return usage_error("La plantilla del cuerpo está vacía.")
+    if not recipients:
+        return usage_error("No se encontraron destinatarios.")
+    variables = recipient_variables(recipients)
+    attachments_dir = args.attachments_dir
+    if attachments_dir is None and args.recipients:
+        attachments_dir = os.path.dirname(os.path.abspath(args.recipients))
+    attachment_options = {
+        "attachments": args.attach,
+        "attachment_patterns": args.attach_pattern,
+        "attachments_dir": attachments_dir,
+        "variables": variables,
+    }
+
+    if args.dry_run:
+        try:
+            engine = DryRunEngine(args.from_email, args.subject, body_template, args.dry_run,
+                                  args.dry_run_format, events=events, processes=args.processes,
+                                  **attachment_options)
+        except TemplateError as e:
+            return usage_error(str(e))
+        except OSError as e:
+            return usage_error(f"No se pudo leer el adjunto: {e}")
+        if not check_attachments(engine, recipients, args, events):
+            return EXIT_USAGE
+        summary = engine.run(recipients)
+        return EXIT_INCOMPLETE if summary["failed"] or summary["pending"] else EXIT_OK
+
+    engine_options = {
+        "connections": args.connections,
+        "recycle_after": args.recycle_after,
+        "max_attempts": args.max_attempts,
+        "batch_size": args.batch_size,
+        "connect_timeout": args.connect_timeout,
+        "command_timeout": args.command_timeout,
+        "data_timeout": args.data_timeout,
+        "stall_timeout": args.stall_timeout,
+        "domain_connections": args.domain_connections,
+        "domain_rate": args.domain_rate,
+        "adaptive": args.adaptive,
+        **attachment_options,
+    }
+    outbox = OutboxManager(os.path.abspath(args.outbox)) if args.outbox else None
+    try:
+        if accounts is not None:
+            # Cada cuenta usa sus propios límites (o los de su proveedor)
+            engine = MultiAccountEngine(accounts, args.subject, body_template, events=events,
+                                        **engine_options)
+        else:
+            engine = EmailSenderEngine(
+                SmtpSettings(args.server, args.port, args.user, password, args.from_email,
+                             implicit_tls=TLS_MODES[args.tls]),
+                args.subject,
+                body_template,
+                events=events,
+                outbox=outbox,
+                rate_limits=rate_limits_from_args(args),
+                metrics_path=args.metrics,
+                **engine_options
+            )
+    except TemplateError as e:
+        return usage_error(str(e))
+    except OSError as e:
+        return usage_error(f"No se pudo leer el adjunto: {e}")
+    if not check_attachments(engine, recipients, args, events):
+        return EXIT_USAGE
+
+    if outbox is not None:
+        unfinished = outbox.find_unfinished_campaign(
+            campaign_key(args.from_email, args.subject, body_template,
+                         engine.attachment_settings))
+        if unfinished:
+            engine.campaign_id = unfinished["id"]
+
+    try:
+        summary = engine.run(recipients)
+    finally:
+        if outbox is not None:
+            outbox.close_connection()
+    if args.report:
+        try:
+            write_report(args.report, recipients, engine.results,
+                         getattr(engine, "assignments", None))
+        except OSError as e:
+            events.put(("log", f"No se pudo guardar el informe en {args.report}: {e}", "error"))
+
+    if events.fatal and not summary["sent"]:
+        return EXIT_CONNECTION
+    if summary["failed"] or summary["pending"] or summary["uncertain"]:
+        return EXIT_INCOMPLETE
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())